@@ -7,10 +7,12 @@ from utils.utils import (
     display_page_titles_sidebar,
     TEAMS,
 )
+from utils.session_pool import get_current_user_id
 from utils.designs import (
     apply_default_custom_css,
     display_applied_message,
     background_image,
+    emit_stylesheet,
 )
 
 
@@ -18,9 +20,11 @@ display_page_titles_sidebar()
 
 
 st.title("🏯複雑空城、決戦の時")
+css_name = apply_default_custom_css()
+background_image("pages/common/images/sky.png", dark_mode=False)
+emit_stylesheet()
 display_team_id_sidebar()
 
-css_name = apply_default_custom_css()
 message = """
 *部門ごとに分断されたデータ、その場凌ぎの改修、無秩序に散在したデータ*
 
@@ -36,7 +40,6 @@ message = """
 """
 
 display_applied_message(message, css_name)
-background_image("pages/common/images/sky.png", dark_mode=False)
 
 st.write("")
 team_id = st.selectbox(
@@ -48,6 +51,8 @@ if team_id:
     st.session_state.clear()
     st.session_state.team_id = team_id
     st.session_state.snow_session = create_session(TEAMS[team_id])
+    # 討伐隊の選択時にユーザー名を解決しておき、各問題ではキャッシュを使い回す。
+    get_current_user_id(st.session_state.snow_session)
 
     if st.button("戦場へ進む"):
         print(st.session_state)
@@ -1,34 +1,41 @@
-# from streamlit_profiler import Profiler
-
 import streamlit as st
-import os
-import importlib
 
 from utils.utils import (
     check_is_clear,
-    update_clear_status,
+    update_all_problem_statuses,
     reset_problem_status,
     display_page_titles_sidebar,
     display_team_id_sidebar,
+    display_submit_job_errors,
+    display_query_accounting_sidebar,
     get_session,
     get_team_id,
-    TAB_TITLES,
-    DEMON_NAME,
 )
 from utils.designs import (
     apply_default_custom_css,
     display_applied_message,
+    apply_demon_ui_css,
     background_image,
-    display_demon_message_html
+    display_demon_message_html,
+    emit_stylesheet,
 )
-from utils.attempt_limiter import check_is_failed, update_failed_status
+from utils.attempt_limiter import check_is_failed
+from utils.problem_registry import get_problem_registry
+from utils.profiler import display_profiler_sidebar, get_profiler
+from utils.session_pool import get_current_user_id
 
-# with Profiler():  # 性能調査をする場合はコメントアウトを外して下記コードをすべてインデント下げる。
+# 性能調査をする場合は、設定の profiler を有効にすると各フェーズの所要時間を記録できる。
+profiler = get_profiler()
+profiler.begin_rerun()
+profiler.phase("render-header")
 
 display_page_titles_sidebar()
 
 st.title("⚔️柱の試練")
 background_image("pages/common/images/wars.png")
+apply_default_custom_css()
+apply_demon_ui_css()
+emit_stylesheet()
 
 team_id = get_team_id()
 if f"{team_id}_display_preparation_message" not in st.session_state:
@@ -36,44 +43,37 @@ if f"{team_id}_display_preparation_message" not in st.session_state:
 
 session = get_session()
 display_team_id_sidebar()
+display_submit_job_errors()
 
-problems_dir = "pages/normal_problems"
-problem_files = [f for f in os.listdir(problems_dir) if f.endswith(".py")]
-
-tabs = {}
-for file in problem_files:
-    module_name = file[:-3]
-    module_path = f"pages.normal_problems.{module_name}"
-    tabs[module_name] = importlib.import_module(module_path)
+profiler.phase("discover")
+# 問題の一覧はプロセスで一度だけ構築したレジストリから取得する。
+registry = get_problem_registry()
 
 tab_titles = []
 problem_ids = []
 state = {}
-state["team_id"] = session.get_current_user()[1:-1]
+state["team_id"] = get_current_user_id(session)
 
 progress_text = "Loading..."
 progress_bar = st.progress(value=0, text=progress_text)
-total_steps = len(tabs.keys())
-
-for i, problem_id in enumerate(tabs.keys()):
+total_steps = len(registry.problem_ids())
+
+profiler.phase("status")
+# 初回表示時は、全問題のクリア・敗北状況を一括で取得する。
+init_problem_ids = [
+    problem_id
+    for problem_id in registry.problem_ids()
+    if f"{problem_id}_{state['team_id']}_is_init_updated" not in st.session_state
+]
+if init_problem_ids:
+    update_all_problem_statuses(session, state["team_id"], init_problem_ids)
+    for problem_id in init_problem_ids:
+        st.session_state[f"{problem_id}_{state['team_id']}_is_init_updated"] = True
+
+for i, problem_id in enumerate(registry.problem_ids()):
     progress_bar.progress(int((i + 1) / total_steps * 100), progress_text)
     state["problem_id"] = problem_id
 
-    # タブタイトルの定義にない問題はスキップする
-    if problem_id not in TAB_TITLES:
-        continue
-
-    #
-    if (
-        f"{state['problem_id']}_{state['team_id']}_is_init_updated"
-        not in st.session_state
-    ):
-        st.session_state[
-            f"{state['problem_id']}_{state['team_id']}_is_init_updated"
-        ] = True
-        update_clear_status(session, state)
-        update_failed_status(session, state)
-
     # タブ名、タブステートの初期化
     if f"{state['problem_id']}_{state['team_id']}_title" not in st.session_state:
 
@@ -105,7 +105,7 @@ for i, problem_id in enumerate(tabs.keys()):
 
         # タブタイトル（物理名）にフラグを追加する処理
         st.session_state[f"{state['problem_id']}_{state['team_id']}_title"] = (
-            checker + TAB_TITLES[problem_id]
+            checker + registry.get(problem_id)["title"]
         )
 
     # タブタイトル（物理名）の追加
@@ -155,12 +155,14 @@ selected_problem = st.selectbox(
 selected_problem_id = problem_ids[tab_titles.index(selected_problem)]
 
 
+demon_name = registry.get(selected_problem_id)["demon_name"]
 message = f"""
 お前らがあの <b>{team_id}</b> のものたちか。
-この『{DEMON_NAME[selected_problem_id]}』を倒せるものなら倒してみよ！！
+この『{demon_name}』を倒せるものなら倒してみよ！！
 """
-avatar_image_path = f"pages/common/images/demons/{DEMON_NAME[selected_problem_id]}.png"
+avatar_image_path = f"pages/common/images/demons/{demon_name}.png"
 
+profiler.phase("render-avatar")
 display_demon_message_html(
     message,
     avatar_image=avatar_image_path,
@@ -170,7 +172,9 @@ display_demon_message_html(
 st.write("")
 st.write("")
 
-tabs[selected_problem_id].run(selected_problem_id, session)
+profiler.phase("problem-run")
+# 選択された問題のモジュールだけを import する。
+registry.load_module(selected_problem_id).run(selected_problem_id, session)
 
 
 # タブの実装の場合
@@ -178,7 +182,10 @@ tabs[selected_problem_id].run(selected_problem_id, session)
 
 # for i, tab_title in enumerate(problem_ids):
 #     with selected_tab[i]:
-#         tabs[tab_title].run(tab_title, session)
+#         registry.load_module(tab_title).run(tab_title, session)
 
 
 progress_bar.empty()
+profiler.end_rerun()
+display_query_accounting_sidebar()
+display_profiler_sidebar()
@@ -1,20 +1,30 @@
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
-import snowflake.snowpark.functions as F
 
 from utils.utils import (
     display_team_id_sidebar,
     display_page_titles_sidebar,
+    display_query_accounting_sidebar,
     get_session,
     get_team_id,
     TAB_TITLES,
     TEAMS,
 )
+from utils.scoreboard import (
+    get_clear_counts,
+    get_ranking,
+    get_scoreboard_cache,
+    get_scoreboard_version,
+)
+from utils.session_pool import get_session_pool
+from utils.settings import get_setting
 from utils.designs import (
     apply_default_custom_css,
     display_applied_message,
     background_image,
+    emit_stylesheet,
 )
 
 
@@ -24,14 +34,18 @@ num_display_ranking = 3
 
 st.title("📜鬼討伐進捗の帳")
 background_image("pages/common/images/library.png")
+css_name = apply_default_custom_css()
+emit_stylesheet()
 display_page_titles_sidebar()
 display_team_id_sidebar()
 get_team_id()
 
 with st.sidebar:
     display_on_pc = st.toggle("文字サイズ：大")
+    if get_setting("debug", False):
+        st.caption(f"集計キャッシュ: {get_scoreboard_cache().stats()}")
+        st.caption(f"セッションプール: {get_session_pool().metrics()}")
 
-css_name = apply_default_custom_css()
 message = "ここでは、現在の各討伐隊の挑戦状況を確認できるんだ。\n\n君達もどんどん挑戦して進んでね！"
 display_applied_message(message, css_name)
 st.write("")
@@ -59,49 +73,29 @@ for problem_id in problem_ids:
         st.session_state[f"{problem_id}_is_over_clear"] = False
 
 
+# ページ全体が再実行された場合は、回答状況が変わっていなくても描画し直す。
+st.session_state["chart_rendered_version"] = None
+st.session_state["ranking_rendered_version"] = None
+
 st.subheader("問題ごとの鬼討伐隊数")
 chart_placeholder = st.empty()
 
 
-@st.fragment(run_every="10s")
-def update_chart():
-    df = session.table("submit2")
-    df_grouped = (
-        df.select(F.col("problem_id"), F.col("team_id"), F.col("is_clear"))
-        .group_by([F.col("problem_id"), F.col("team_id")])
-        .agg(F.call_builtin("boolor_agg", F.col("is_clear")).alias("is_clear"))
-        .group_by([F.col("problem_id")])
-        .agg(F.count(F.col("is_clear")).alias("is_clear"))
-        .to_pandas()
-    )
-
-    result = pdf_problem_ids.merge(
-        df_grouped, left_on="problem_id", right_on="PROBLEM_ID", how="left"
+def build_clear_chart() -> go.Figure:
+    # グラフの枠組みは一度だけ作り、更新時は棒の高さと色だけを差し替える。
+    fig = go.Figure(
+        go.Bar(
+            x=pdf_problem_ids["problem_name"],
+            y=[0] * len(pdf_problem_ids),
+            marker_color="#29B5E8",
+            showlegend=False,
+        )
     )
-
-    result["IS_CLEAR"] = result["IS_CLEAR"].fillna(0)
-
-    result["color"] = "#29B5E8"  # デフォルトカラー（薄いSnowflake色）
-
-    # 雪を降らせる処理
-    for index, row in result.iterrows():
-        if row["IS_CLEAR"] >= CLEAR_COUNT:
-            result.at[index, "color"] = "#c2e5f2"  # 色を薄い青色に変更
-
-            # クリアカウントを超えた場合の通知の表示と雪を降らせる処理
-            if not st.session_state[f"{row['problem_id']}_is_over_clear"]:
-                st.success(f"「{row['problem_name'][:-1]}」の的屋が解放されたようだ！")
-                st.snow()
-                st.session_state[f"{row['problem_id']}_is_over_clear"] = True
-
-    fig = px.bar(
-        result,
-        x="problem_name",
-        y="IS_CLEAR",
-        color="color",
-        color_discrete_map="identity",
-        labels={"problem_name": "", "IS_CLEAR": "鬼討伐隊数"},
-        category_orders={"problem_name": pdf_problem_ids["problem_name"].tolist()},
+    fig.update_layout(
+        xaxis_title="",
+        yaxis_title="鬼討伐隊数",
+        xaxis_categoryorder="array",
+        xaxis_categoryarray=pdf_problem_ids["problem_name"].tolist(),
     )
 
     if display_on_pc:
@@ -134,58 +128,77 @@ def update_chart():
         line=dict(color="#ff4b4b", width=3),
     )
 
-    chart_placeholder.plotly_chart(fig, use_container_width=True)
+    return fig
+
+
+chart_state_name = f"clear_chart_{'pc' if display_on_pc else 'default'}"
+if chart_state_name not in st.session_state:
+    st.session_state[chart_state_name] = build_clear_chart()
 
 
 @st.fragment(run_every="10s")
-def update_ranking():
-    df_submit = session.table("submit2")
+def update_chart():
+    # 回答状況が前回の描画から変わっていなければ、集計もグラフの作り直しも行わない。
+    version = get_scoreboard_version(session)
+    if st.session_state["chart_rendered_version"] == version:
+        return
 
-    # Step 1: 各チームが最初に解けた問題を取得
-    df_solved_problems = (
-        df_submit.filter(F.col("is_clear") == True)
-        .group_by(F.col("team_id"), F.col("problem_id"))
-        .agg(F.min(F.col("timestamp")).alias("first_clear_time"))
-    )
+    # 集計はプロセス内の台帳から取得し、SUBMIT2 を毎回スキャンしない。
+    df_grouped = get_clear_counts(session)
 
-    # Step 2: チームごとの解けた問題数と解答速度（秒単位）を計算
-    df_team_scores = df_solved_problems.group_by(F.col("team_id")).agg(
-        F.count(F.col("problem_id")).alias("solved_problems_count"),
-        F.sum(
-            F.datediff(
-                "second",
-                F.to_timestamp(F.lit("2024-09-01 00:00:00")),
-                F.col("first_clear_time"),
-            )
-        ).alias("total_solve_time"),
+    result = pdf_problem_ids.merge(
+        df_grouped, left_on="problem_id", right_on="PROBLEM_ID", how="left"
     )
 
-    # Step 3: スコアを計算し、最終的な結果を取得
-    pdf_final_scores = (
-        df_team_scores.select(
-            F.col("team_id"),
-            F.col("solved_problems_count"),
-            (
-                F.col("solved_problems_count") * 100000
-                - (F.col("total_solve_time") / 3600)
-            ).alias("score"),
-        )
-        .order_by(F.col("score").desc())
-        .limit(num_display_ranking)
-        .to_pandas()
+    result["IS_CLEAR"] = result["IS_CLEAR"].fillna(0)
+
+    # クリアカウントを超えた問題は色を薄い青色に変更（デフォルトは薄いSnowflake色）
+    is_over_clear = result["IS_CLEAR"] >= CLEAR_COUNT
+    result["color"] = np.where(is_over_clear, "#c2e5f2", "#29B5E8")
+
+    # クリアカウントを新たに超えた問題だけ、通知の表示と雪を降らせる処理を行う。
+    was_over_clear = result["problem_id"].map(
+        lambda problem_id: st.session_state[f"{problem_id}_is_over_clear"]
     )
+    for problem_id, problem_name in result.loc[
+        is_over_clear & ~was_over_clear, ["problem_id", "problem_name"]
+    ].itertuples(index=False):
+        st.success(f"「{problem_name[:-1]}」の的屋が解放されたようだ！")
+        st.snow()
+        st.session_state[f"{problem_id}_is_over_clear"] = True
+
+    fig = st.session_state[chart_state_name]
+    with fig.batch_update():
+        fig.data[0].y = result["IS_CLEAR"].tolist()
+        fig.data[0].marker.color = result["color"].tolist()
+
+    chart_placeholder.plotly_chart(fig, use_container_width=True)
+    st.session_state["chart_rendered_version"] = version
+
+
+@st.fragment(run_every="10s")
+def update_ranking():
+    version = get_scoreboard_version(session)
+    if st.session_state["ranking_rendered_version"] == version:
+        return
+
+    pdf_final_scores = get_ranking(session, num_display_ranking)
 
     # 結果の表示
     pdf_final_scores["TEAM_NAME"] = pdf_final_scores["TEAM_ID"].map(reversed_team_ids)
     pdf_final_scores.index = range(1, len(pdf_final_scores) + 1)
 
-    st.dataframe(pdf_final_scores["TEAM_NAME"])
+    # 描画を省略した回も表示が残るよう、フラグメント外のプレースホルダーに描画する。
+    ranking_placeholder.dataframe(pdf_final_scores["TEAM_NAME"])
+    st.session_state["ranking_rendered_version"] = version
 
 
 update_chart()
 
 if is_display_ranking:
     st.subheader(f"ランキング（Top{num_display_ranking}）")
+    ranking_placeholder = st.empty()
     update_ranking()
 
 st.write("\n\n\n")
+display_query_accounting_sidebar()
@@ -2,11 +2,12 @@ import streamlit as st
 import os
 from snowflake.snowpark import Session
 
-from utils.utils import save_table, init_state, clear_submit_button
+from utils.utils import save_table, init_state, clear_submit_button, issue_submit_id
 from utils.attempt_limiter import check_is_failed, init_attempt, process_exceeded_limit
+from utils.problem_registry import PROBLEM_MANIFEST
 from utils.designs import header_animation, display_problem_statement_swt25
 
-MAX_ATTEMPTS_MAIN = 100
+MAX_ATTEMPTS_MAIN = PROBLEM_MANIFEST["q4_test"]["max_attempts"]
 
 
 def present_quiz(tab_name: str, max_attempts: int) -> list:
@@ -142,7 +143,12 @@ def run(tab_name: str, session: Session):
     placeholder = st.empty()
     if check_is_failed(session, state):
         process_exceeded_limit(placeholder, state)
-    elif placeholder.button("Answer", key=f"{tab_name}_submit"):
+    elif placeholder.button(
+        "Answer",
+        key=f"{tab_name}_submit",
+        on_click=issue_submit_id,
+        args=(state["team_id"], tab_name),
+    ):
         if main_attempt.check_attempt():
             # Check if all options have been selected
             all_selected = all(value is not None for value in st.session_state.selected_options.values())
@@ -1,16 +1,19 @@
 import streamlit as st
-import pandas as pd
-import requests
 import snowflake.connector
+from concurrent.futures import Future
 from typing import Dict, Any, List, Optional
 import os
 import time
 
-from utils.utils import save_table, init_state, clear_submit_button
+from utils.utils import save_table, init_state, clear_submit_button, display_table_preview, issue_submit_id
 from utils.attempt_limiter import check_is_failed, init_attempt, process_exceeded_limit
+from utils.cortex_client import CortexAnalystError, get_cortex_client
+from utils.problem_registry import PROBLEM_MANIFEST
+from utils.query import run_query_cached
+from utils.settings import get_setting
 from utils.designs import header_animation, display_problem_statement_swt25
 
-MAX_ATTEMPTS_MAIN = 100
+MAX_ATTEMPTS_MAIN = PROBLEM_MANIFEST["q6_test"]["max_attempts"]
 MAX_HINTS = 2
 
 # Cortex Analyst設定
@@ -18,6 +21,7 @@ DATABASE = "SNOWFLAKE_LEARNING_DB"
 SCHEMA = "CORTEX_ANALYST_DEMO"
 STAGE = "RAW_DATA"
 FILE = "semantic_model_J_CI_FD20.yaml"
+SEMANTIC_MODEL_FILE = f"@{DATABASE}.{SCHEMA}.{STAGE}/{FILE}"
 
 
 # === Snowflake接続関数 ===
@@ -26,63 +30,111 @@ def build_connector(session):
 
 # === Cortex Analyst関連関数 ===
 
+def get_cortex_base_url(connector) -> str:
+    """Cortex AnalystのベースURLを取得（スタブサーバーで確認する場合は設定で上書き）"""
+    host = getattr(connector, 'host', 'FSUOFLI-SQ50969.snowflakecomputing.com')
+    return get_setting("cortex_base_url", f"https://{host}")
+
+def get_connector_token(connector) -> Optional[str]:
+    """接続から認証トークンを取得"""
+    if hasattr(connector, 'rest') and hasattr(connector.rest, 'token'):
+        return connector.rest.token
+    return None
+
 def send_cortex_message(prompt: str, connector) -> Optional[Dict[str, Any]]:
     """Cortex Analystにメッセージを送信"""
     try:
-        request_body = {
-            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
-            "semantic_model_file": f"@{DATABASE}.{SCHEMA}.{STAGE}/{FILE}",
-        }
-        
-        # ホスト情報を取得
-        host = getattr(connector, 'host', 'FSUOFLI-SQ50969.snowflakecomputing.com')
-        
-        # トークンを取得
-        if hasattr(connector, 'rest') and hasattr(connector.rest, 'token'):
-            token = connector.rest.token
-        else:
+        token = get_connector_token(connector)
+        if token is None:
             # トークンが取得できない場合はエラー
             st.error("認証トークンの取得に失敗しました")
             return None
-        
-        resp = requests.post(
-            url=f"https://{host}/api/v2/cortex/analyst/message",
-            json=request_body,
-            headers={
-                "Authorization": f'Snowflake Token="{token}"',
-                "Content-Type": "application/json",
-            },
-            timeout=30
-        )
-        
-        if resp.status_code < 400:
-            return resp.json()
-        else:
-            st.error(f"Cortex Analyst API Error: {resp.status_code}")
-            return None
-            
+
+        client = get_cortex_client(get_cortex_base_url(connector))
+        return client.send_message(prompt, SEMANTIC_MODEL_FILE, token)
+
+    except CortexAnalystError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Cortex Analystエラー: {str(e)}")
         return None
 
-def display_cortex_content(content: List[Dict[str, str]], connector) -> None:
-    """Cortexレスポンスを表示"""
-    for item in content:
+def submit_cortex_message(prompt: str, connector) -> Optional[Future]:
+    """Cortex Analystへの送信をバックグラウンドで開始し、すぐに戻る"""
+    token = get_connector_token(connector)
+    if token is None:
+        st.error("認証トークンの取得に失敗しました")
+        return None
+
+    client = get_cortex_client(get_cortex_base_url(connector))
+    return client.submit_message(prompt, SEMANTIC_MODEL_FILE, token)
+
+def poll_pending_hint(tab_name: str) -> None:
+    """バックグラウンドで取得中のヒントを確認し、届いていればページを再描画"""
+    pending = st.session_state.get(f'{tab_name}_pending_hint')
+    if pending is None:
+        return
+
+    future = pending['future']
+    if not future.done():
+        st.info("⏳ Cortex Analystが分析中...（結果が届き次第表示されます）")
+        return
+
+    del st.session_state[f'{tab_name}_pending_hint']
+    try:
+        response = future.result()
+        st.session_state[f'{tab_name}_hints_history'].append({
+            'question': pending['question'],
+            'response': response["message"]["content"],
+            'results': {}
+        })
+        st.session_state[f'{tab_name}_show_latest_hint'] = True
+    except CortexAnalystError as e:
+        st.session_state[f'{tab_name}_hint_count'] -= 1
+        st.session_state[f'{tab_name}_hint_error'] = str(e)
+    except Exception as e:
+        st.session_state[f'{tab_name}_hint_count'] -= 1
+        st.session_state[f'{tab_name}_hint_error'] = f"Cortex Analystエラー: {str(e)}"
+    st.rerun()
+
+def display_cortex_content(
+    content: List[Dict[str, str]], connector, results: Optional[Dict[int, Any]] = None
+) -> None:
+    """Cortexレスポンスを表示（results があれば、実行済みの結果を使い回す）"""
+    for i, item in enumerate(content):
         if item["type"] == "text":
             st.markdown(item["text"])
         elif item["type"] == "sql":
             with st.expander("SQLクエリ", expanded=False):
                 st.code(item["statement"], language="sql")
             with st.expander("実行結果", expanded=True):
+                if results is not None and i in results:
+                    show_sql_result(results[i])
+                    continue
                 try:
                     with st.spinner("SQL実行中..."):
-                        df = pd.read_sql(item["statement"], connector)
-                        st.dataframe(df, use_container_width=True)
+                        result = run_query_cached(connector, item["statement"])
                 except Exception as e:
-                    st.error(f"SQL実行エラー: {str(e)}")
+                    # エラーはヒント履歴に保存せず、次の再実行で実行し直す。
+                    show_sql_result(f"SQL実行エラー: {str(e)}")
+                    continue
+                # 初回の実行結果をヒント履歴に保存し、再実行時はウェアハウスに問い合わせない。
+                if results is not None:
+                    results[i] = result
+                show_sql_result(result)
+
+def show_sql_result(result) -> None:
+    """SQLの実行結果（Arrowテーブル、またはエラーメッセージ）を表示"""
+    if isinstance(result, str):
+        st.error(result)
+    else:
+        st.dataframe(result["data"], use_container_width=True)
+        if result["is_truncated"]:
+            st.caption(f"※ 結果が大きいため、先頭 {result['data'].num_rows} 行のみ表示しています")
 
 # === メイン関数 ===
-def present_quiz(tab_name: str = "q6_test", connector=None) -> str:
+def present_quiz(tab_name: str = "q6_test", connector=None, session=None) -> str:
     """クイズ問題を表示"""
     
     header_animation()
@@ -102,17 +154,7 @@ def present_quiz(tab_name: str = "q6_test", connector=None) -> str:
     
     # データサンプル表示
     if connector:
-        with st.expander("📊 データテーブル構造を確認", expanded=False):
-            try:
-                sample_query = f"""
-                SELECT * FROM {DATABASE}.{SCHEMA}.J_CI_FD20 
-                LIMIT 5
-                """
-                sample_df = pd.read_sql(sample_query, connector)
-                st.dataframe(sample_df, use_container_width=True)
-                st.caption(f"データソース: {DATABASE}.{SCHEMA}.J_CI_FD20")
-            except Exception as e:
-                st.error(f"データ取得エラー: {str(e)}")
+        display_table_preview(session, f"{DATABASE}.{SCHEMA}.J_CI_FD20")
     else:
         st.warning("データベースに接続されていません")
     
@@ -152,34 +194,70 @@ def present_quiz(tab_name: str = "q6_test", connector=None) -> str:
                 "ヒント取得",
                 key=f"{tab_name}_get_hint",
                 type="primary",
-                disabled=(st.session_state[f'{tab_name}_hint_count'] >= MAX_HINTS or not connector)
+                disabled=(
+                    st.session_state[f'{tab_name}_hint_count'] >= MAX_HINTS
+                    or not connector
+                    or f'{tab_name}_pending_hint' in st.session_state
+                )
             )
         
-        if get_hint and hint_question and connector:
+        if get_hint and hint_question and connector and get_setting("cortex_async", True):
+            # バックグラウンドで問い合わせ、結果は届き次第表示する。
+            st.session_state[f'{tab_name}_hint_count'] += 1
+            future = submit_cortex_message(hint_question, connector)
+            if future:
+                st.session_state[f'{tab_name}_pending_hint'] = {
+                    'question': hint_question,
+                    'future': future
+                }
+            else:
+                st.session_state[f'{tab_name}_hint_count'] -= 1
+        elif get_hint and hint_question and connector:
             st.session_state[f'{tab_name}_hint_count'] += 1
             with st.spinner("Cortex Analystが分析中..."):
                 response = send_cortex_message(hint_question, connector)
                 if response:
                     hint_result = {
                         'question': hint_question,
-                        'response': response["message"]["content"]
+                        'response': response["message"]["content"],
+                        'results': {}
                     }
                     st.session_state[f'{tab_name}_hints_history'].append(hint_result)
                     
                     st.success(f"ヒント {st.session_state[f'{tab_name}_hint_count']} 取得完了")
-                    display_cortex_content(response["message"]["content"], connector)
+                    display_cortex_content(
+                        hint_result['response'], connector, hint_result['results']
+                    )
                 else:
                     st.session_state[f'{tab_name}_hint_count'] -= 1
     else:
         st.warning("⚠️ ヒントの使用回数が上限に達しました。自力で解答してください。")
     
+    # バックグラウンドで取得中のヒントがあれば、届くまで定期的に確認する。
+    if f'{tab_name}_pending_hint' in st.session_state:
+        st.fragment(poll_pending_hint, run_every="1s")(tab_name)
+    
+    hint_error = st.session_state.pop(f'{tab_name}_hint_error', None)
+    if hint_error:
+        st.error(hint_error)
+    
+    if st.session_state.pop(f'{tab_name}_show_latest_hint', False):
+        st.success(f"ヒント {st.session_state[f'{tab_name}_hint_count']} 取得完了")
+        if connector:
+            latest_hint = st.session_state[f'{tab_name}_hints_history'][-1]
+            display_cortex_content(
+                latest_hint['response'], connector, latest_hint['results']
+            )
+    
     # 過去のヒント表示
     if st.session_state[f'{tab_name}_hints_history']:
         with st.expander("📜 取得済みヒント履歴", expanded=False):
             for i, hint in enumerate(st.session_state[f'{tab_name}_hints_history'], 1):
                 st.markdown(f"**ヒント {i}: {hint['question']}**")
                 if connector:
-                    display_cortex_content(hint['response'], connector)
+                    display_cortex_content(
+                        hint['response'], connector, hint['results']
+                    )
                 st.markdown("---")
     
     # 回答入力
@@ -226,12 +304,17 @@ def run(tab_name: str = "q6_test", session = None):
     )
     
     connector = build_connector(session)
-    answer = present_quiz(tab_name, connector)
+    answer = present_quiz(tab_name, connector, session)
     
     placeholder = st.empty()
     if check_is_failed(session, state):
         process_exceeded_limit(placeholder, state)
-    elif placeholder.button("Answer", key=f"{tab_name}_submit"):
+    elif placeholder.button(
+        "Answer",
+        key=f"{tab_name}_submit",
+        on_click=issue_submit_id,
+        args=(state["team_id"], tab_name),
+    ):
         if main_attempt.check_attempt():
                 process_answer(answer, state, session)
         else:
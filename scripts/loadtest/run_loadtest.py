@@ -0,0 +1,348 @@
+"""柱の試練と鬼討伐進捗の帳に、複数チームが同時にアクセスした場合の負荷試験。
+
+Snowflake には接続せず、ローカルの代替バックエンド（backend = "local"）に対して
+streamlit.testing の AppTest で実際のページを実行する。
+
+    python scripts/loadtest/run_loadtest.py --teams 24 --viewers 4 --latency 0.15 --processes 24
+
+各チームは全問題を順に選択し、ANSWER_SCRIPTS の手順で入力して回答ボタンを最大 --submits 回押す。
+1 回目は不正解、2 回目は正解になり、クリアした問題はそこで次の問題に進む。
+閲覧者は全チームが終わるまで、鬼討伐進捗の帳を --view-interval 秒ごとに再実行する。
+
+AppTest は実行のたびにプロセス全体の状態（ページ一覧、secrets など）を差し替えるため、
+1 つのプロセスの中では再実行を 1 つずつ行う。--processes を指定すると、チームと閲覧者を
+その数のプロセスに振り分け、プロセスどうしは同時に再実行する。各プロセスはアプリの
+レプリカに相当し、キャッシュ・台帳・書き込みバッファ・ローカルバックエンドをプロセスごとに持つ。
+--processes 1（既定）の p50/p95/p99 は、競合のない再実行 1 回ずつの所要時間になる。
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+
+from streamlit.testing.v1 import AppTest
+
+from utils.local_backend import get_local_backend
+from utils.problem_registry import get_problem_registry
+from utils.submit_buffer import SUBMIT_TABLE, get_submit_buffer
+from utils.utils import TEAMS
+
+
+ENTRYPOINT = str(ROOT_DIR / "app.py")
+PROBLEM_PAGE = "pages/01_normal_problems.py"
+AGGREGATE_PAGE = "pages/03_aggregate_results.py"
+
+# 問題ごとの回答の手順。n 回目の回答では n 番目の手順（足りなければ最後の手順）を入力してから回答する。
+# 各問題とも 1 回目は不正解、2 回目は正解になるようにしている。
+# 手順は (ウィジェットの種類, key, 値)。"button" は値を使わず、押して再実行する。
+Q3_OPTION_COUNT = 5
+Q4_EXIST = ["Snowpark Container Services", "Data Lake", "Star Schema"]
+Q4_NOT_EXIST = ["Data Mart", "Openflow", "Retrieval Augmented Generation"]
+
+ANSWER_SCRIPTS = {
+    "q1_test": [
+        [("selectbox", f"q1_test_image_{i}", value) for i, value in enumerate("ABCD")],
+        [("selectbox", f"q1_test_image_{i}", value) for i, value in enumerate("DBCA")],
+    ],
+    "q2_test": [
+        [("selectbox", "q2_test_selection", "①")],
+        [("selectbox", "q2_test_selection", "⑥")],
+    ],
+    "q3_test": [
+        [("checkbox", "q3_test_option_0", True)],
+        [("checkbox", f"q3_test_option_{i}", True) for i in range(Q3_OPTION_COUNT)],
+    ],
+    "q4_test": [
+        [("button", f"button_{option}_left", None) for option in Q4_EXIST + Q4_NOT_EXIST],
+        [("button", f"button_{option}_left", None) for option in Q4_EXIST]
+        + [("button", f"button_{option}_right", None) for option in Q4_NOT_EXIST],
+    ],
+    "q5_test": [
+        [("radio", "q5_test_answer1", "約700人"), ("radio", "q5_test_answer2", "2020年9月")],
+        [("radio", "q5_test_answer1", "約1,900人"), ("radio", "q5_test_answer2", "2020年9月")],
+    ],
+    "q6_test": [
+        [("text_input", "q6_test_answer_input", "東京都")],
+        [("text_input", "q6_test_answer_input", "岡山県")],
+    ],
+}
+
+
+class LoadTestRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self.latencies = {}
+        self.queries = {}
+        self.errors = []
+        # ウォームアップでバックエンドが作られた後に設定する。
+        self.backend = None
+
+    def _query_count(self) -> int:
+        return self.backend.query_count() if self.backend is not None else 0
+
+    def run(self, at: AppTest, kind: str, timeout: float) -> AppTest:
+        with self._run_lock:
+            # 再実行は 1 つずつ行うため、この間のクエリは（フラッシュ用スレッドの分を除き）この再実行のもの。
+            queries_before = self._query_count()
+            started_at = time.perf_counter()
+            try:
+                at.run(timeout=timeout)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append(f"{kind}: {e!r}")
+                return at
+            elapsed = time.perf_counter() - started_at
+            queries = self._query_count() - queries_before
+
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(elapsed)
+            self.queries[kind] = self.queries.get(kind, 0) + queries
+            for exception in at.exception:
+                self.errors.append(f"{kind}: {exception.message}")
+        return at
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def build_app_test(page: str, team_name: str, secrets: dict) -> AppTest:
+    # st.page_link() がページを解決できるよう、エントリーポイントから起動してページを切り替える。
+    at = AppTest.from_file(ENTRYPOINT)
+    at.switch_page(page)
+    at.secrets["swtt"] = secrets
+    # app.py で討伐隊を選択した直後の状態を再現する。セッションは get_session() がプールから取り直す。
+    at.session_state["team_id"] = team_name
+    at.session_state["snow_session"] = None
+    return at
+
+
+def run_team(
+    team_name: str, args: argparse.Namespace, secrets: dict, recorder: LoadTestRecorder
+) -> None:
+    at = build_app_test(PROBLEM_PAGE, team_name, secrets)
+    recorder.run(at, "load", args.timeout)
+
+    problem_ids = get_problem_registry().problem_ids()
+    for index, problem_id in enumerate(problem_ids):
+        at.selectbox(key=f"{team_name}_selected_problem").select_index(index)
+        recorder.run(at, "select", args.timeout)
+
+        scripts = ANSWER_SCRIPTS.get(problem_id, [[]])
+        for attempt in range(args.submits):
+            if not any(button.key == f"{problem_id}_submit" for button in at.button):
+                # クリア済み・挑戦回数切れの場合は回答ボタンが表示されない。
+                break
+            for widget_type, key, value in scripts[min(attempt, len(scripts) - 1)]:
+                if widget_type == "button":
+                    at.button(key=key).click()
+                    recorder.run(at, "answer", args.timeout)
+                else:
+                    getattr(at, widget_type)(key=key).set_value(value)
+
+            at.button(key=f"{problem_id}_submit").click()
+            recorder.run(at, "submit", args.timeout)
+            time.sleep(args.think_time)
+
+
+def run_viewer(
+    team_name: str,
+    args: argparse.Namespace,
+    secrets: dict,
+    recorder: LoadTestRecorder,
+    stop: threading.Event,
+) -> None:
+    at = build_app_test(AGGREGATE_PAGE, team_name, secrets)
+    at.session_state["problem_ids"] = get_problem_registry().problem_ids()
+    while not stop.is_set():
+        recorder.run(at, "view", args.timeout)
+        stop.wait(args.view_interval)
+
+
+def run_replica(
+    team_names: list, viewer_team_names: list, args: argparse.Namespace
+) -> dict:
+    # 1 つのプロセス（アプリのレプリカ）で、担当するチームと閲覧者を動かす。
+    secrets = {
+        "backend": "local",
+        "local_latency": args.latency,
+        "local_latency_jitter": args.latency_jitter,
+    }
+    recorder = LoadTestRecorder()
+
+    # バックエンドやキャッシュは AppTest の実行中に secrets を読んで作られるため、先に 1 回実行しておく。
+    recorder.run(
+        build_app_test(PROBLEM_PAGE, team_names[0], secrets), "warmup", args.timeout
+    )
+    backend = get_local_backend()
+    session = backend.build_session("loadtest")
+    rows_before = session.table(SUBMIT_TABLE).count()
+    queries_before = backend.query_count()
+    recorder.backend = backend
+
+    stop = threading.Event()
+    with ThreadPoolExecutor(
+        max_workers=len(team_names) + len(viewer_team_names)
+    ) as executor:
+        viewers = [
+            executor.submit(run_viewer, team_name, args, secrets, recorder, stop)
+            for team_name in viewer_team_names
+        ]
+        teams = [
+            executor.submit(run_team, team_name, args, secrets, recorder)
+            for team_name in team_names
+        ]
+        try:
+            for future in teams:
+                future.result()
+        finally:
+            stop.set()
+        for future in viewers:
+            future.result()
+
+    get_submit_buffer().flush()
+    # 行数の確認に使うクエリを含めないよう、先に数える。
+    queries = backend.query_count() - queries_before
+    rows_written = session.table(SUBMIT_TABLE).count() - rows_before
+    recorder.queries.pop("warmup", None)
+    recorder.latencies.pop("warmup", None)
+    return {
+        "latencies": recorder.latencies,
+        "queries": recorder.queries,
+        # 再実行の外（フラッシュ用スレッドなど）で発生したクエリ。
+        "background_queries": queries - sum(recorder.queries.values()),
+        "rows_written": rows_written,
+        "errors": recorder.errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--teams", type=int, default=len(TEAMS) - 1)
+    parser.add_argument("--viewers", type=int, default=2)
+    parser.add_argument("--submits", type=int, default=2, help="問題ごとの回答回数")
+    parser.add_argument("--latency", type=float, default=0.1, help="クエリごとの待ち時間（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.05)
+    # submit_id はボタンを押すたびに発行されるため、間隔を空けなくても回答は 1 回ずつ記録される。
+    parser.add_argument("--think-time", type=float, default=0.0, help="回答の間隔（秒）")
+    parser.add_argument("--view-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--processes", type=int, default=1, help="同時に再実行するプロセス（レプリカ）の数"
+    )
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="結果を JSON で書き出すファイル")
+    args = parser.parse_args()
+    # 画像などのパスはリポジトリ直下からの相対パスで指定されている。
+    os.chdir(ROOT_DIR)
+
+    team_names = [name for name in TEAMS if name][: args.teams]
+    processes = max(1, min(args.processes, len(team_names)))
+    # チームと閲覧者は、プロセスに順番に振り分ける。
+    replicas = [
+        (
+            team_names[i::processes],
+            [
+                team_names[j % len(team_names)]
+                for j in range(args.viewers)
+                if j % processes == i
+            ],
+        )
+        for i in range(processes)
+    ]
+
+    started_at = time.perf_counter()
+    if processes == 1:
+        results = [run_replica(*replicas[0], args)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(run_replica, teams, viewers, args)
+                for teams, viewers in replicas
+            ]
+            results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started_at
+
+    latencies = {}
+    queries_by_kind = {}
+    for result in results:
+        for kind, values in result["latencies"].items():
+            latencies.setdefault(kind, []).extend(values)
+        for kind, count in result["queries"].items():
+            queries_by_kind[kind] = queries_by_kind.get(kind, 0) + count
+    background_queries = sum(result["background_queries"] for result in results)
+    queries = sum(queries_by_kind.values()) + background_queries
+    rows_written = sum(result["rows_written"] for result in results)
+    errors = [error for result in results for error in result["errors"]]
+    clicks = len(latencies.get("submit", []))
+    reruns = sum(len(values) for values in latencies.values())
+
+    report = {
+        "teams": len(team_names),
+        "viewers": args.viewers,
+        "processes": processes,
+        # 1 プロセスあたり複数のチーム・閲覧者がいる場合、再実行は 1 つずつ行われる。
+        "serialized": processes < len(team_names) + args.viewers,
+        "elapsed": elapsed,
+        "reruns": {
+            kind: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for kind, values in latencies.items()
+        },
+        "queries": queries,
+        "queries_by_kind": queries_by_kind,
+        "background_queries": background_queries,
+        "queries_per_rerun": queries / reruns if reruns else 0.0,
+        "queries_per_click": (
+            queries_by_kind.get("submit", 0) / clicks if clicks else 0.0
+        ),
+        "submit_clicks": clicks,
+        "rows_written": rows_written,
+        "errors": errors,
+    }
+
+    print(
+        f"teams={report['teams']} viewers={report['viewers']} "
+        f"processes={processes} elapsed={elapsed:.1f}s"
+    )
+    if processes == 1:
+        print("（再実行は 1 つずつ行うため、p50/p95/p99 は競合のない所要時間です）")
+    elif report["serialized"]:
+        print("（同じプロセスに振り分けたチーム・閲覧者の再実行は、1 つずつ行われます）")
+    for kind, stats in report["reruns"].items():
+        print(
+            f"{kind:<7} n={stats['count']:<5} p50={stats['p50'] * 1000:8.1f}ms "
+            f"p95={stats['p95'] * 1000:8.1f}ms p99={stats['p99'] * 1000:8.1f}ms "
+            f"queries={queries_by_kind.get(kind, 0)}"
+        )
+    print(
+        f"queries={queries} background={background_queries} "
+        f"per_rerun={report['queries_per_rerun']:.2f} "
+        f"per_click={report['queries_per_click']:.2f}"
+    )
+    # 未選択のまま回答した場合や、挑戦回数を使い切った後の回答は書き込まれないため、行数はクリック数以下になる。
+    print(f"submit_clicks={clicks} rows_written={rows_written}")
+    print(f"errors={len(errors)}")
+    for error in errors[:10]:
+        print(f"  {error}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
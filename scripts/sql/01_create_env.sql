@@ -14,8 +14,36 @@ create or replace TABLE SWTT_TEST.PUBLIC.SUBMIT2 (
 	TIMESTAMP TIMESTAMP_NTZ(9),
 	IS_CLEAR BOOLEAN,
 	KEY VARCHAR(16777216),
-	MAX_ATTEMPTS NUMBER(38,0)
-);
+	MAX_ATTEMPTS NUMBER(38,0),
+	SUBMIT_ID VARCHAR(16777216)
+) cluster by (TEAM_ID, PROBLEM_ID, KEY);
+-- 既存の SUBMIT2 に SUBMIT_ID 列を追加する場合はこちらを実行する。
+-- alter table SWTT_TEST.PUBLIC.SUBMIT2 add column if not exists SUBMIT_ID VARCHAR(16777216);
+-- alter table SWTT_TEST.PUBLIC.SUBMIT2 cluster by (TEAM_ID, PROBLEM_ID, KEY);
+
+-- SUBMIT2 を (TEAM_ID, PROBLEM_ID, KEY) ごとに集約したテーブル。アプリが書き込みのたびに MERGE で更新する。
+use role sysadmin;
+create or replace TABLE SWTT_TEST.PUBLIC.TEAM_PROBLEM_STATUS (
+	TEAM_ID VARCHAR(16777216),
+	PROBLEM_ID VARCHAR(16777216),
+	KEY VARCHAR(16777216),
+	ATTEMPTS NUMBER(38,0),
+	MAX_ATTEMPTS NUMBER(38,0),
+	FIRST_CLEAR_TS TIMESTAMP_NTZ(9),
+	LAST_TS TIMESTAMP_NTZ(9)
+) cluster by (TEAM_ID, PROBLEM_ID, KEY);
+-- 既存の SUBMIT2 から作り直す場合はこちらを実行する。
+insert overwrite into SWTT_TEST.PUBLIC.TEAM_PROBLEM_STATUS
+select
+    team_id,
+    problem_id,
+    key,
+    count(*) as attempts,
+    max(max_attempts) as max_attempts,
+    min(iff(is_clear, timestamp, null)) as first_clear_ts,
+    max(timestamp) as last_ts
+from SWTT_TEST.PUBLIC.SUBMIT2
+group by team_id, problem_id, key;
 
 
 use role sysadmin;
@@ -14,6 +14,7 @@ use role sysadmin; // SYSADMINに戻しておく。
 -- 各テーブルが空であることを確認する
 use role sysadmin; 
 select * from swtt_test.public.submit2;
+select * from swtt_test.public.team_problem_status;
 
 use role sysadmin;
 select * from swtt_test.public.hand_data;
@@ -27,8 +28,18 @@ create or replace TABLE SWTT_TEST.PUBLIC.SUBMIT2 (
 	TIMESTAMP TIMESTAMP_NTZ(9),
 	IS_CLEAR BOOLEAN,
 	KEY VARCHAR(16777216),
-	MAX_ATTEMPTS NUMBER(38,0)
-);
+	MAX_ATTEMPTS NUMBER(38,0),
+	SUBMIT_ID VARCHAR(16777216)
+) cluster by (TEAM_ID, PROBLEM_ID, KEY);
+create or replace TABLE SWTT_TEST.PUBLIC.TEAM_PROBLEM_STATUS (
+	TEAM_ID VARCHAR(16777216),
+	PROBLEM_ID VARCHAR(16777216),
+	KEY VARCHAR(16777216),
+	ATTEMPTS NUMBER(38,0),
+	MAX_ATTEMPTS NUMBER(38,0),
+	FIRST_CLEAR_TS TIMESTAMP_NTZ(9),
+	LAST_TS TIMESTAMP_NTZ(9)
+) cluster by (TEAM_ID, PROBLEM_ID, KEY);
 */
 
 use role sysadmin;
@@ -58,6 +69,19 @@ INSERT INTO SWTT_TEST.PUBLIC.SUBMIT2 (TEAM_ID, PROBLEM_ID, TIMESTAMP, IS_CLEAR,
 SELECT SUBSTR(UUID_STRING(), 1, 10), 'be_positive', CURRENT_TIMESTAMP, TRUE, NULL, NULL;
 // 上の問題IDだけ変更する：be_positive, whats_squad, chat_with_ai, real_ice, rsp, nw_role, sort_services, real_wanage
 
+-- SUBMIT2 を直接変更した（上の 2 つのクエリを実行した）後は、集約テーブルを作り直す。
+insert overwrite into SWTT_TEST.PUBLIC.TEAM_PROBLEM_STATUS
+select
+    team_id,
+    problem_id,
+    key,
+    count(*) as attempts,
+    max(max_attempts) as max_attempts,
+    min(iff(is_clear, timestamp, null)) as first_clear_ts,
+    max(timestamp) as last_ts
+from SWTT_TEST.PUBLIC.SUBMIT2
+group by team_id, problem_id, key;
+
 
 
 -- ランキング取得クエリ
@@ -67,9 +91,9 @@ WITH solved_problems AS (
     SELECT
         team_id,
         problem_id,
-        MIN(timestamp) AS first_clear_time
-    FROM submit2
-    WHERE is_clear = true
+        MIN(first_clear_ts) AS first_clear_time
+    FROM team_problem_status
+    WHERE first_clear_ts IS NOT NULL
     GROUP BY team_id, problem_id
 ),
 team_scores AS (
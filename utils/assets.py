@@ -0,0 +1,107 @@
+import base64
+import hashlib
+import io
+import os
+from urllib.parse import quote
+
+import streamlit as st
+from PIL import Image
+
+from utils.settings import get_setting
+
+
+ASSET_IMAGE_FORMAT = "WEBP"
+ASSET_IMAGE_QUALITY = 80
+ASSET_CACHE_MAX_ENTRIES = 32
+
+# Streamlit の静的ファイル配信は、メインスクリプトと同じ階層の static/ 以下を app/static/ で公開する。
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
+STATIC_ASSET_DIR = "assets"
+
+
+def encode_image_variant(
+    image_file: str,
+    width: int = None,
+    image_format: str = ASSET_IMAGE_FORMAT,
+    quality: int = ASSET_IMAGE_QUALITY,
+) -> bytes:
+    # 表示サイズより大きい画像は縮小してから再エンコードする。拡大はしない。
+    with Image.open(image_file) as image:
+        image.load()
+        if width and image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=quality, method=6)
+        return buffer.getvalue()
+
+
+@st.cache_data(max_entries=ASSET_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_image_data_uri(
+    image_file: str, width: int, image_format: str, modified_at: float
+) -> str:
+    # modified_at はキャッシュキーとしてのみ使う。画像を差し替えたら再エンコードされる。
+    encoded_string = base64.b64encode(
+        encode_image_variant(image_file, width, image_format)
+    ).decode()
+    return f"data:image/{image_format.lower()};base64,{encoded_string}"
+
+
+def image_data_uri(
+    image_file: str, width: int = None, image_format: str = ASSET_IMAGE_FORMAT
+) -> str:
+    """表示サイズに縮小・WebP 化した画像の data URI を返す（プロセス全体で LRU キャッシュ）。"""
+    return _cached_image_data_uri(
+        image_file, width, image_format, os.path.getmtime(image_file)
+    )
+
+
+def is_static_serving_enabled() -> bool:
+    # [swtt] static_assets と server.enableStaticServing の両方が有効な場合のみ静的配信に切り替える。
+    return bool(get_setting("static_assets", False)) and bool(
+        st.get_option("server.enableStaticServing")
+    )
+
+
+@st.cache_data(max_entries=ASSET_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_static_asset_url(
+    image_file: str, width: int, image_format: str, modified_at: float
+) -> str:
+    data = encode_image_variant(image_file, width, image_format)
+    content_hash = hashlib.sha256(data).hexdigest()[:16]
+
+    # 内容のハッシュをファイル名に含め、画像が変わった場合は別の URL になるようにする。
+    stem = os.path.splitext(os.path.basename(image_file))[0]
+    suffix = f"{width}w" if width else "orig"
+    file_name = f"{stem}.{suffix}.{content_hash}.{image_format.lower()}"
+
+    asset_dir = os.path.join(STATIC_ROOT, STATIC_ASSET_DIR)
+    asset_path = os.path.join(asset_dir, file_name)
+    if not os.path.exists(asset_path):
+        os.makedirs(asset_dir, exist_ok=True)
+        temp_path = f"{asset_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, asset_path)
+
+    # ファイル名にハッシュを含めるため、内容が変わると URL も変わる。
+    # 長期の Cache-Control が付くのは ?v= を解釈する Tornado の静的ファイル配信のみで、
+    # Starlette の配信（Streamlit 1.66 で確認）は ETag / Last-Modified による再検証になる。
+    return f"app/static/{STATIC_ASSET_DIR}/{quote(file_name)}?v={content_hash}"
+
+
+def image_url(
+    image_file: str, width: int = None, image_format: str = ASSET_IMAGE_FORMAT
+) -> str:
+    """画像の参照先を返す。静的配信が有効ならハッシュ付き URL、無効なら data URI。"""
+    if is_static_serving_enabled():
+        try:
+            return _cached_static_asset_url(
+                image_file, width, image_format, os.path.getmtime(image_file)
+            )
+        except OSError as e:
+            print("静的ファイルの書き出しに失敗したため、data URI で表示します。")
+            print(e)
+
+    return image_data_uri(image_file, width, image_format)
@@ -1,9 +1,9 @@
-from datetime import datetime
-
 import streamlit as st
-import pandas as pd
 from snowflake.snowpark import Session
-from snowflake.snowpark import functions as F
+
+from utils.session_pool import get_current_user_id
+from utils.submit_buffer import SubmitJob
+from utils.submit_ledger import get_submit_ledger, record_submission
 
 
 class AttemptLimiter:
@@ -22,94 +22,41 @@ class AttemptLimiter:
         self.key = key
 
     def __check_attempt_table(self) -> bool:
-        session = self.session
-        attempt_table = session.table("submit2")
-
-        try:
-            current_attempts = attempt_table.filter(
-                (F.col("team_id") == self.team_id)
-                & (F.col("problem_id") == self.problem_id)
-                & (F.col("key") == self.key)
-            ).count()
-
-            return current_attempts < self.max_attempts
-
-        except IndexError as e:
-            print(e)
-            return False
-
-    def __add_attempt_table(self) -> None:
-        session = self.session
-
-        df = pd.DataFrame(
-            [
-                {
-                    "team_id": self.team_id,
-                    "problem_id": self.problem_id,
-                    "timestamp": datetime.now(),
-                    "is_clear": None,
-                    "key": self.key,
-                    "max_attempts": self.max_attempts,
-                }
-            ],
-            index=[0],
+        current_attempts = get_submit_ledger().attempts(
+            self.session, self.team_id, self.problem_id, self.key
+        )
+
+        return current_attempts < self.max_attempts
+
+    def __add_attempt_table(self) -> SubmitJob:
+        return record_submission(
+            self.session, self.team_id, self.problem_id, None, self.key, self.max_attempts
         )
-        new_column_order = [
-            "team_id",
-            "problem_id",
-            "timestamp",
-            "is_clear",
-            "key",
-            "max_attempts",
-        ]
-        df = df[new_column_order]
-
-        snow_df = session.create_dataframe(df)
-        snow_df.write.mode("append").save_as_table("submit2", block=False)
 
     def check_attempt(self) -> bool:
         return self.__check_attempt_table()
 
-    def add_attempt(self):
-        self.__add_attempt_table()
+    def add_attempt(self) -> SubmitJob:
+        return self.__add_attempt_table()
 
 
 def init_attempt(
     max_attempts: int, tab_name: str, session: Session, key: str = "main"
 ) -> AttemptLimiter:
     problem_id = tab_name
-    team_id = session.get_current_user()[1:-1]
+    team_id = get_current_user_id(session)
 
     return AttemptLimiter(max_attempts, problem_id, team_id, session, key)
 
 
 def update_failed_status(session: Session, state: dict) -> None:
-    attempt_table = session.table("submit2")
-
-    try:
-        query_result = (
-            attempt_table.filter(
-                (F.col("team_id") == state["team_id"])
-                & (F.col("problem_id") == state["problem_id"])
-                & (F.col("key") == "main")
-            )
-            .select("max_attempts")
-            .collect()
-        )
+    entry = get_submit_ledger().get(session, state["team_id"], state["problem_id"])
 
-        if query_result:
-            max_attempts = query_result[0]["MAX_ATTEMPTS"]
-            current_attempts = len(query_result)
-            st.session_state[f"{state['problem_id']}_{state['team_id']}_is_failed"] = (
-                current_attempts >= max_attempts
-            )
-        else:
-            st.session_state[f"{state['problem_id']}_{state['team_id']}_is_failed"] = (
-                False
-            )
-
-    except IndexError as e:
-        print(e)
+    if entry["attempts"] > 0 and entry["max_attempts"] is not None:
+        st.session_state[f"{state['problem_id']}_{state['team_id']}_is_failed"] = (
+            entry["attempts"] >= entry["max_attempts"]
+        )
+    else:
         st.session_state[f"{state['problem_id']}_{state['team_id']}_is_failed"] = False
 
 
@@ -0,0 +1,107 @@
+import re
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+from utils.settings import get_setting
+from utils.shared_cache import SharedTTLCache
+
+
+CORTEX_ANALYST_PATH = "/api/v2/cortex/analyst/message"
+
+
+def normalize_prompt(prompt: str) -> str:
+    # 全角・半角や空白の違いだけの質問は同じものとして扱う。
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", prompt)).strip().lower()
+
+
+class CortexAnalystError(Exception):
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CortexAnalystClient:
+    """Cortex Analyst の REST API クライアント。
+
+    HTTP 接続は requests.Session で使い回す（keep-alive）。
+    submit_message() はバックグラウンドのスレッドで送信し、すぐに Future を返す。
+    Streamlit には依存しないため、base_url をローカルのスタブサーバーに向けて動作確認できる。
+
+    response_cache を渡すと、正規化した質問とセマンティックモデルが同じ問い合わせは
+    キャッシュした応答を返し、Cortex Analyst を呼び出さない。
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 30,
+        max_workers: int = 4,
+        response_cache: SharedTTLCache = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.response_cache = response_cache
+
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._http.mount("https://", adapter)
+        self._http.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="cortex-analyst"
+        )
+
+    def send_message(
+        self, prompt: str, semantic_model_file: str, token: str
+    ) -> Dict[str, Any]:
+        if self.response_cache is None:
+            return self._post_message(prompt, semantic_model_file, token)
+
+        return self.response_cache.get_or_load(
+            (normalize_prompt(prompt), semantic_model_file),
+            lambda: self._post_message(prompt, semantic_model_file, token),
+        )
+
+    def _post_message(
+        self, prompt: str, semantic_model_file: str, token: str
+    ) -> Dict[str, Any]:
+        request_body = {
+            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            "semantic_model_file": semantic_model_file,
+        }
+        resp = self._http.post(
+            url=f"{self.base_url}{CORTEX_ANALYST_PATH}",
+            json=request_body,
+            headers={
+                "Authorization": f'Snowflake Token="{token}"',
+                "Content-Type": "application/json",
+            },
+            timeout=self.timeout,
+        )
+
+        if resp.status_code >= 400:
+            raise CortexAnalystError(
+                f"Cortex Analyst API Error: {resp.status_code}", resp.status_code
+            )
+        return resp.json()
+
+    def submit_message(
+        self, prompt: str, semantic_model_file: str, token: str
+    ) -> Future:
+        return self._executor.submit(
+            self.send_message, prompt, semantic_model_file, token
+        )
+
+
+@st.cache_resource
+def get_cortex_client(base_url: str) -> CortexAnalystClient:
+    return CortexAnalystClient(
+        base_url,
+        response_cache=SharedTTLCache(
+            ttl=float(get_setting("cortex_cache_ttl", 600.0)), max_entries=256
+        ),
+    )
@@ -1,18 +1,60 @@
+import re
+
 import streamlit as st
 
+from utils.assets import image_url
+
 
 DEFAULT_TOP_TEXT_AREA = "custom-text-area"
 DEFAULT_HEADER_ANIMATION_AREA = "custom-animation-header-area"
 DEFAULT_PROBLEM_STATEMENT_AREA = "custom-problem-statement-area"
 
+STYLESHEET_STATE_NAME = "stylesheet_fragments"
 
-def apply_default_custom_css():
+
+def minify_css(css: str) -> str:
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def register_css(name: str, css: str) -> None:
+    """CSS を名前付きで登録する。出力は emit_stylesheet() でまとめて行う。
+
+    同じ名前の CSS は一度だけ出力する。
+    """
+    fragments = st.session_state.setdefault(STYLESHEET_STATE_NAME, {})
+    if name not in fragments:
+        fragments[name] = minify_css(css)
+
+
+def emit_stylesheet() -> None:
+    """登録済みの CSS を 1 つの <style> ブロックとして出力する。
+
+    各ページの先頭で必要な CSS を登録した後に一度だけ呼ぶ。出力した CSS は登録から外す。
+    """
+    fragments = st.session_state.pop(STYLESHEET_STATE_NAME, {})
+    if not fragments:
+        return
+
+    # @import はスタイルシートの先頭にしか書けないため、まとめて先頭に移す。
+    combined = "".join(fragments.values())
+    imports = re.findall(r"@import [^;]+;", combined)
+    for css_import in imports:
+        combined = combined.replace(css_import, "")
     st.markdown(
+        "<style>" + "".join(dict.fromkeys(imports)) + combined + "</style>",
+        unsafe_allow_html=True,
+    )
+
+
+def apply_default_custom_css():
+    register_css(
+        "default-custom",
         """
-        <link rel="preconnect" href="https://fonts.googleapis.com">
-        <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-        <link href="https://fonts.googleapis.com/css2?family=Zen+Antique&display=swap" rel="stylesheet">
-        <style>
+        @import url('https://fonts.googleapis.com/css2?family=Zen+Antique&display=swap');
         h1, h2, div, p {
             font-family: "Zen Antique", serif !important;
         }
@@ -43,20 +85,14 @@ def apply_default_custom_css():
         + """ p:last-child {
             margin-bottom: 0;
         }
-        </style>
         """,
-        unsafe_allow_html=True,
     )
 
     return DEFAULT_TOP_TEXT_AREA
 
 
 def display_applied_message(message: str, css_name: str = DEFAULT_TOP_TEXT_AREA):
-    if css_name == DEFAULT_TOP_TEXT_AREA:
-        apply_default_custom_css()
-    else:
-        apply_default_custom_css()
-
+    # CSS はページの先頭で apply_default_custom_css() と emit_stylesheet() により出力しておく。
     st.markdown(
         f"""
         <div class='{css_name}'>
@@ -70,10 +106,7 @@ def header_animation(
     css_name: str = DEFAULT_HEADER_ANIMATION_AREA,
     image_file: str = "pages/common/images/background.png",
 ) -> None:
-    import base64
-
-    with open(image_file, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
+    image_uri = image_url(image_file)
     st.html(
         f"""
         <div class="{css_name}">
@@ -84,7 +117,7 @@ def header_animation(
             position: relative;
             overflow: hidden;
             background-color: rgba(0, 64, 128, 0.8);
-            background-image: url(data:image/{"png"};base64,{encoded_string});
+            background-image: url('{image_uri}');
             margin: 0 calc(50% - 50vw);
             width: 100vw;
             height: 30px;
@@ -131,10 +164,7 @@ def display_problem_statement(
     css_name: str = DEFAULT_PROBLEM_STATEMENT_AREA,
     image_file: str = "pages/common/images/quest.jpeg",
 ):
-    import base64
-
-    with open(image_file, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
+    image_uri = image_url(image_file)
     st.html(
         f"""
         <p>
@@ -147,7 +177,7 @@ def display_problem_statement(
             }}
             .{css_name} {{
                 background-color: rgba(2, 2, 2, 0);
-                background-image: url(data:image/{"png"};base64,{encoded_string});
+                background-image: url('{image_uri}');
                 background-position: top;
                 padding: 40px 5%;
                 color: #9e1717;
@@ -184,14 +214,10 @@ def display_problem_statement_swt25(
     )
 
 
-@st.cache_data
 def background_image(
     image_file: str = "pages/common/images/sky.png", dark_mode: bool = True
 ):
-    import base64
-
-    with open(image_file, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
+    image_uri = image_url(image_file)
 
     dark_mode_css = ""
     if dark_mode:
@@ -207,11 +233,11 @@ def background_image(
         }
         """
 
-    st.markdown(
+    register_css(
+        "background-image",
         f"""
-    <style>
     [data-testid="stAppViewContainer"] > .main {{
-        background-image: url(data:image/{"png"};base64,{encoded_string});
+        background-image: url('{image_uri}');
         background-size: cover;
         background-position: center;
         background-repeat: no-repeat;
@@ -227,9 +253,7 @@ def background_image(
     .stAlert p, .stTabs button p{{
         color: #fff !important;
     }}
-    </style>
     """,
-        unsafe_allow_html=True,
     )
 
 
@@ -239,9 +263,9 @@ DEFAULT_DEMON_BUBBLE = "sf-demon-bubble"
 
 def apply_demon_ui_css():
     """鬼アバター用の最小CSS。既存のフォント指定を継承（font-familyは書かない）。"""
-    st.markdown(
+    register_css(
+        "demon-ui",
         """
-        <style>
         .""" + DEFAULT_DEMON_ROW + """ {
             display: flex;
             align-items: flex-start;
@@ -274,9 +298,7 @@ def apply_demon_ui_css():
         @media (max-width: 480px) {
             .""" + DEFAULT_DEMON_ROW + """ { gap: 8px; }
         }
-        </style>
         """,
-        unsafe_allow_html=True,
     )
     return DEFAULT_DEMON_ROW
 
@@ -286,20 +308,18 @@ def display_demon_message_html(
     avatar_size=64,
     avatar_alt="avatar",
 ):
-    apply_default_custom_css()
-    apply_demon_ui_css()
-
+    # CSS はページの先頭で apply_default_custom_css()・apply_demon_ui_css() と
+    # emit_stylesheet() により出力しておく。
     # 画像（任意）
     img_html = ""
     if avatar_image:
-        import base64, mimetypes, os
+        import os
         if os.path.exists(avatar_image):
-            mime = mimetypes.guess_type(avatar_image)[0] or "image/png"
-            with open(avatar_image, "rb") as f:
-                b64 = base64.b64encode(f.read()).decode()
+            # 高解像度ディスプレイ向けに表示サイズの 2 倍に縮小した画像を使う。
+            src = image_url(avatar_image, width=avatar_size * 2)
             img_html = (
-                "<img class='" + DEFAULT_DEMON_AVATAR + "' src='data:" + mime +
-                ";base64," + b64 + "' alt='" + avatar_alt + "' />"
+                "<img class='" + DEFAULT_DEMON_AVATAR + "' src='" + src +
+                "' alt='" + avatar_alt + "' />"
             )
 
     html = (
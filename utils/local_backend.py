@@ -0,0 +1,126 @@
+import random
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+from snowflake.snowpark import Session
+
+from utils.settings import get_setting
+from utils.submit_buffer import (
+    STATUS_SCHEMA,
+    STATUS_TABLE,
+    SUBMIT_SCHEMA,
+    SUBMIT_TABLE,
+)
+
+# local testing の非公開 API を使うため、動作を確認した Snowpark のバージョンを明示する。
+CHECKED_SNOWPARK_VERSION = "1.55.2"
+
+try:
+    from snowflake.snowpark.mock._connection import MockServerConnection
+except ImportError as e:
+    raise ImportError(
+        "ローカルバックエンドには Snowpark の local testing が必要です。"
+        f"snowflake-snowpark-python=={CHECKED_SNOWPARK_VERSION} で動作を確認しています。"
+    ) from e
+
+if not hasattr(MockServerConnection({"local_testing": True}), "entity_registry"):
+    raise ImportError(
+        "この Snowpark の local testing はテーブルの共有に対応していません。"
+        f"snowflake-snowpark-python=={CHECKED_SNOWPARK_VERSION} で動作を確認しています。"
+    )
+
+
+class LocalServerConnection(MockServerConnection):
+    """Snowpark の local testing 用コネクションに、クエリごとの待ち時間を加えたもの。
+
+    テーブルはバックエンド全体で共有するため、どのチームのセッションからも同じ内容が見える。
+    """
+
+    def __init__(self, backend: "LocalBackend"):
+        super().__init__({"local_testing": True})
+        self._backend = backend
+        self.entity_registry = backend.entity_registry
+
+    def execute(self, *args, **kwargs):
+        self._backend.wait()
+        return super().execute(*args, **kwargs)
+
+
+class LocalSession(Session):
+    """チームごとのユーザーとして振る舞う、ローカルの代替セッション。"""
+
+    def __init__(self, conn: LocalServerConnection, team_id: str):
+        super().__init__(conn, {"local_testing": True})
+        self._team_id = team_id
+
+    def get_current_user(self) -> str:
+        self._conn._backend.wait()
+        return f'"{self._team_id.upper()}"'
+
+    def sql(self, query: str, *args, **kwargs):
+        # local testing は SQL を実行できない。アプリが使うのはヘルスチェックの SELECT 1 のみ。
+        if query.strip().upper() == "SELECT 1":
+            return self.create_dataframe([[1]], schema=["ONE"])
+        return super().sql(query, *args, **kwargs)
+
+
+class LocalBackend:
+    """Snowflake の代わりにプロセス内のテーブルを使うバックエンド。
+
+    SUBMIT2 と TEAM_PROBLEM_STATUS は空の状態で作成する。
+    seed_dir を指定した場合は、その中の CSV をファイル名と同じ名前のテーブルとして読み込む
+    （例: SNOWFLAKE_LEARNING_DB.CORTEX_ANALYST_DEMO.J_CI_FD20.csv）。
+
+    Snowflake に近い応答時間で計測できるよう、クエリごとに latency 秒
+    （± latency_jitter 秒）待つ。
+    """
+
+    def __init__(
+        self, latency: float = 0.0, latency_jitter: float = 0.0, seed_dir: str = None
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+
+        self._lock = threading.Lock()
+        self._query_count = 0
+
+        bootstrap_conn = MockServerConnection({"local_testing": True})
+        self.entity_registry = bootstrap_conn.entity_registry
+        bootstrap = LocalSession(LocalServerConnection(self), "")
+        bootstrap.create_dataframe([], schema=SUBMIT_SCHEMA).write.save_as_table(
+            SUBMIT_TABLE
+        )
+        bootstrap.create_dataframe([], schema=STATUS_SCHEMA).write.save_as_table(
+            STATUS_TABLE
+        )
+        if seed_dir:
+            for path in sorted(Path(seed_dir).glob("*.csv")):
+                bootstrap.create_dataframe(pd.read_csv(path)).write.save_as_table(
+                    path.stem
+                )
+
+    def wait(self) -> None:
+        with self._lock:
+            self._query_count += 1
+        delay = self.latency + random.uniform(-self.latency_jitter, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def query_count(self) -> int:
+        with self._lock:
+            return self._query_count
+
+    def build_session(self, team_id: str) -> LocalSession:
+        return LocalSession(LocalServerConnection(self), team_id)
+
+
+@st.cache_resource
+def get_local_backend() -> LocalBackend:
+    return LocalBackend(
+        latency=float(get_setting("local_latency", 0.0)),
+        latency_jitter=float(get_setting("local_latency_jitter", 0.0)),
+        seed_dir=get_setting("local_seed_dir"),
+    )
@@ -0,0 +1,75 @@
+import importlib
+import threading
+
+import streamlit as st
+
+
+PROBLEMS_PACKAGE = "pages.normal_problems"
+
+# 柱の試練に表示する問題の一覧。表示順もこの順番になる。
+# Key: 問題ID（pages/normal_problems 以下のモジュール名）
+PROBLEM_MANIFEST = {
+    "q1_test": {
+        "title": "⌛️過去忘却の鬼 ~ 歴史の呼吸 ~",
+        "demon_name": "過去忘却の鬼",
+        "max_attempts": 100,
+    },
+    "q2_test": {
+        "title": "🧩不規則の鬼 ~ 法則の呼吸 ~",
+        "demon_name": "不規則の鬼",
+        "max_attempts": 100,
+    },
+    "q3_test": {
+        "title": "🧭混迷の鬼 ~ 判別の呼吸 ~",
+        "demon_name": "混迷の鬼",
+        "max_attempts": 100,
+    },
+    "q4_test": {
+        "title": "🔍️真偽の鬼 ~ 見極めの呼吸 ~",
+        "demon_name": "真偽の鬼",
+        "max_attempts": 100,
+    },
+    "q5_test": {
+        "title": "🌊波紋の鬼 ~ コミュニティの呼吸 ~",
+        "demon_name": "波紋の鬼",
+        "max_attempts": 100,
+    },
+    "q6_test": {
+        "title": "📊分析の鬼 ~ 言葉の呼吸 ~",
+        "demon_name": "分析の鬼",
+        "max_attempts": 100,
+    },
+}
+
+
+class ProblemRegistry:
+    """問題のメタデータと問題モジュールを保持するレジストリ。
+
+    モジュールは最初に選択されたときにだけ import し、以降は使い回す。
+    """
+
+    def __init__(self, manifest: dict, package: str = PROBLEMS_PACKAGE):
+        self.package = package
+
+        self._manifest = manifest
+        self._modules = {}
+        self._lock = threading.Lock()
+
+    def problem_ids(self) -> list:
+        return list(self._manifest.keys())
+
+    def get(self, problem_id: str) -> dict:
+        return self._manifest[problem_id]
+
+    def load_module(self, problem_id: str):
+        with self._lock:
+            if problem_id not in self._modules:
+                self._modules[problem_id] = importlib.import_module(
+                    f"{self.package}.{problem_id}"
+                )
+            return self._modules[problem_id]
+
+
+@st.cache_resource
+def get_problem_registry() -> ProblemRegistry:
+    return ProblemRegistry(PROBLEM_MANIFEST)
@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from utils.settings import get_setting
+
+
+# ヒストグラムの区切り（ミリ秒）。
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+PROFILER_STATE_NAME = "profiler_rerun"
+
+
+class PhaseProfiler:
+    """ページの再実行を名前付きのフェーズに区切り、所要時間を記録する。
+
+    フェーズは phase() を呼んだ時点で切り替わり、end_rerun() で最後のフェーズと全体の時間を記録する。
+    st.rerun() や st.stop() で途中終了した再実行は記録しない。
+
+    所要時間はフェーズごとに直近 max_samples 件を保持し、分位点とヒストグラムを出力できる。
+    trace_memory を有効にすると tracemalloc を開始し、セッションごとに再実行前後の
+    メモリ使用量の差分とピークを記録する（プロセス全体の値のため、同時に動いた再実行の分も含む）。
+    """
+
+    def __init__(self, max_samples: int = 500, trace_memory: bool = False):
+        self.max_samples = max_samples
+        self.trace_memory = trace_memory
+
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._memory = {}
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def begin_rerun(self) -> None:
+        now = time.perf_counter()
+        rerun = {"started_at": now, "phase": None, "phase_started_at": now, "phases": {}}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            rerun["memory_started"] = tracemalloc.get_traced_memory()[0]
+        st.session_state[PROFILER_STATE_NAME] = rerun
+
+    def phase(self, name: str) -> None:
+        rerun = st.session_state.get(PROFILER_STATE_NAME)
+        if rerun is None:
+            return
+        now = time.perf_counter()
+        if rerun["phase"] is not None:
+            elapsed = now - rerun["phase_started_at"]
+            rerun["phases"][rerun["phase"]] = (
+                rerun["phases"].get(rerun["phase"], 0.0) + elapsed
+            )
+        rerun["phase"] = name
+        rerun["phase_started_at"] = now
+
+    def end_rerun(self) -> None:
+        rerun = st.session_state.get(PROFILER_STATE_NAME)
+        if rerun is None:
+            return
+        self.phase(None)
+        rerun["phases"]["total"] = time.perf_counter() - rerun["started_at"]
+        del st.session_state[PROFILER_STATE_NAME]
+
+        with self._lock:
+            for name, elapsed in rerun["phases"].items():
+                self._samples.setdefault(name, deque(maxlen=self.max_samples)).append(
+                    elapsed
+                )
+
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            ctx = get_script_run_ctx()
+            session_id = ctx.session_id if ctx is not None else "unknown"
+            with self._lock:
+                self._memory.setdefault(
+                    session_id, deque(maxlen=self.max_samples)
+                ).append(
+                    {
+                        "timestamp": datetime.now().isoformat(),
+                        "delta": current - rerun["memory_started"],
+                        "peak": peak,
+                    }
+                )
+
+    def summary(self) -> pd.DataFrame:
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        return pd.DataFrame(
+            [
+                {
+                    "phase": name,
+                    "count": len(values),
+                    "p50_ms": np.percentile(values, 50) * 1000,
+                    "p95_ms": np.percentile(values, 95) * 1000,
+                    "p99_ms": np.percentile(values, 99) * 1000,
+                    "max_ms": max(values) * 1000,
+                }
+                for name, values in samples.items()
+            ],
+            columns=["phase", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms"],
+        )
+
+    def export(self, top_allocations: int = 0) -> str:
+        # 比較しやすいよう、ヒストグラムは固定の区切りで集計する。最後の区切りは上限なし。
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+            memory = {
+                session_id: list(values) for session_id, values in self._memory.items()
+            }
+
+        bins = [0] + HISTOGRAM_BOUNDS_MS + [float("inf")]
+        exported = {
+            "exported_at": datetime.now().isoformat(),
+            "histogram_bounds_ms": HISTOGRAM_BOUNDS_MS,
+            "phases": {
+                name: {
+                    "samples_ms": [value * 1000 for value in values],
+                    "histogram": np.histogram(
+                        np.array(values) * 1000, bins=bins
+                    )[0].tolist(),
+                }
+                for name, values in samples.items()
+            },
+            "memory": memory,
+        }
+        if self.trace_memory and top_allocations:
+            exported["top_allocations"] = [
+                {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[
+                    :top_allocations
+                ]
+            ]
+        return json.dumps(exported, ensure_ascii=False, indent=2)
+
+
+class _DisabledProfiler:
+    # 計測を無効にしている場合に使う。各呼び出しは何もしない。
+    def begin_rerun(self) -> None:
+        pass
+
+    def phase(self, name: str) -> None:
+        pass
+
+    def end_rerun(self) -> None:
+        pass
+
+
+@st.cache_resource
+def _get_phase_profiler() -> PhaseProfiler:
+    return PhaseProfiler(
+        max_samples=int(get_setting("profiler_max_samples", 500)),
+        trace_memory=bool(get_setting("profiler_trace_memory", False)),
+    )
+
+
+def get_profiler():
+    if get_setting("profiler", False):
+        return _get_phase_profiler()
+    return _DisabledProfiler()
+
+
+def display_profiler_sidebar() -> None:
+    if not get_setting("profiler", False):
+        return
+
+    profiler = _get_phase_profiler()
+    with st.sidebar:
+        st.divider()
+        with st.expander("再実行の計測", expanded=False):
+            st.dataframe(profiler.summary(), hide_index=True)
+            # スナップショットの取得は重いため、必要な場合だけ含める。
+            include_allocations = profiler.trace_memory and st.toggle(
+                "メモリ割り当ての上位を含める"
+            )
+            st.download_button(
+                "計測結果をダウンロード",
+                data=profiler.export(top_allocations=10 if include_allocations else 0),
+                file_name="rerun_profile.json",
+                mime="application/json",
+            )
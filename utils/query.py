@@ -0,0 +1,125 @@
+import hashlib
+
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+from snowflake.connector.errors import NotSupportedError
+from snowflake.snowpark import Session
+
+from utils.query_accounting import account_query
+from utils.settings import get_setting
+from utils.shared_cache import SharedTTLCache
+
+
+@st.cache_resource
+def get_query_result_cache() -> SharedTTLCache:
+    return SharedTTLCache(
+        ttl=float(get_setting("query_cache_ttl", 600.0)), max_entries=256
+    )
+
+
+def statement_hash(statement: str) -> str:
+    return hashlib.sha256(statement.strip().encode("utf-8")).hexdigest()
+
+
+def run_query(
+    connector,
+    statement: str,
+    max_rows: int = None,
+    max_bytes: int = None,
+) -> dict:
+    """SQL を実行し、結果を Arrow のバッチ単位で取得する。
+
+    max_rows 行、または max_bytes バイトに達した時点で取得を打ち切る。
+    取得しなかった行が残っている場合だけ is_truncated を True にする。
+    """
+    # カーソルで直接実行するため、instrument_session() では記録されない。ここで記録する。
+    return account_query(
+        lambda: _run_query(connector, statement, max_rows, max_bytes),
+        count_rows=lambda result: result["data"].num_rows,
+    )
+
+
+def _run_query(connector, statement: str, max_rows: int, max_bytes: int) -> dict:
+    max_rows = max_rows or int(get_setting("query_max_rows", 10000))
+    max_bytes = max_bytes or int(get_setting("query_max_bytes", 50 * 1024 * 1024))
+
+    cursor = connector.cursor()
+    try:
+        cursor.execute(statement)
+        column_names = [column[0] for column in cursor.description or []]
+
+        try:
+            batches = []
+            num_rows = 0
+            num_bytes = 0
+            is_truncated = False
+            arrow_batches = iter(cursor.fetch_arrow_batches())
+            for batch in arrow_batches:
+                if num_rows + batch.num_rows > max_rows:
+                    batch = batch.slice(0, max_rows - num_rows)
+                    is_truncated = True
+                batches.append(batch)
+                num_rows += batch.num_rows
+                num_bytes += batch.nbytes
+                if is_truncated:
+                    break
+                if num_rows >= max_rows or num_bytes >= max_bytes:
+                    # 上限に達したバッチが最後なら何も落としていないため、
+                    # 残りの行があるときだけ打ち切りとする。
+                    is_truncated = any(rest.num_rows for rest in arrow_batches)
+                    break
+            data = (
+                pa.concat_tables(batches)
+                if batches
+                else pa.table({name: pa.array([], pa.null()) for name in column_names})
+            )
+
+        except NotSupportedError:
+            # SHOW コマンドなど Arrow 形式で返らない結果は、行単位で取得する。
+            rows = cursor.fetchmany(max_rows + 1)
+            is_truncated = len(rows) > max_rows
+            data = pa.Table.from_pandas(
+                pd.DataFrame(rows[:max_rows], columns=column_names),
+                preserve_index=False,
+            )
+
+        return {"data": data, "is_truncated": is_truncated}
+
+    finally:
+        cursor.close()
+
+
+def run_query_cached(connector, statement: str) -> dict:
+    # 同じ SQL の実行結果は全チームで共有し、ウェアハウスへの問い合わせを省く。
+    return get_query_result_cache().get_or_load(
+        statement_hash(statement), lambda: run_query(connector, statement)
+    )
+
+
+@st.cache_resource
+def get_table_preview_cache() -> SharedTTLCache:
+    return SharedTTLCache(
+        ttl=float(get_setting("table_preview_cache_ttl", 3600.0)), max_entries=32
+    )
+
+
+def get_table_preview(session: Session, table_name: str, limit: int = 5) -> dict:
+    """テーブルの先頭数行と列定義を返す。結果はプロセス全体で共有する。"""
+
+    def load_table_preview() -> dict:
+        table = session.table(table_name)
+        return {
+            "rows": table.limit(limit).to_pandas(),
+            "schema": pd.DataFrame(
+                [
+                    (field.name, field.datatype.simple_string())
+                    for field in table.schema.fields
+                ],
+                columns=["列名", "データ型"],
+            ),
+        }
+
+    return get_table_preview_cache().get_or_load(
+        (table_name.upper(), limit), load_table_preview
+    )
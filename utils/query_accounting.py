@@ -0,0 +1,182 @@
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+from snowflake.snowpark import Session
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from utils.settings import get_setting
+
+
+# 呼び出し元の関数を探すときに読み飛ばすモジュール。
+_SKIPPED_MODULE_PREFIXES = (
+    "snowflake.",
+    "utils.query_accounting",
+    "utils.shared_cache",
+    "utils.query",
+)
+
+
+def is_query_accounting_enabled() -> bool:
+    return bool(get_setting("query_accounting", False))
+
+
+def _find_caller() -> str:
+    frame = sys._getframe(2)
+    while frame is not None:
+        module_name = frame.f_globals.get("__name__", "")
+        if not module_name.startswith(_SKIPPED_MODULE_PREFIXES):
+            code = frame.f_code
+            function_name = getattr(code, "co_qualname", code.co_name)
+            return f"{module_name}.{function_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _count_rows(result):
+    try:
+        return len(result)
+    except TypeError:
+        # to_local_iterator() などのイテレータは件数が分からない。
+        return None
+
+
+class QueryLog:
+    """Snowflake へのクエリを、呼び出し元の関数・所要時間・行数とともに記録する。
+
+    記録は Streamlit のセッションごとに max_records 件まで保持し、再実行（rerun_id）と
+    ページごとに集計できるようにする。log_path を指定した場合は JSONL にも追記する。
+    フラッシュ用スレッドなど、再実行の外で発生したクエリは "background" として記録する。
+    """
+
+    def __init__(self, max_records: int = 1000, log_path: str = None):
+        self.max_records = max_records
+        self.log_path = Path(log_path) if log_path else None
+
+        self._lock = threading.Lock()
+        self._records = {}
+        self._reruns = {}
+
+    def begin_rerun(self) -> None:
+        ctx = get_script_run_ctx()
+        if ctx is None:
+            return
+        try:
+            page = ctx.pages_manager.get_pages()[ctx.page_script_hash]["page_name"]
+        except (AttributeError, KeyError):
+            page = ""
+        with self._lock:
+            self._reruns[ctx.session_id] = {"rerun_id": uuid.uuid4().hex, "page": page}
+
+    def current_rerun(self) -> dict:
+        ctx = get_script_run_ctx()
+        with self._lock:
+            if ctx is not None and ctx.session_id in self._reruns:
+                return {"session_id": ctx.session_id, **self._reruns[ctx.session_id]}
+        return {"session_id": "background", "rerun_id": "background", "page": ""}
+
+    def record(self, caller: str, elapsed: float, rows, error: str = None) -> None:
+        ctx = get_script_run_ctx()
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            **self.current_rerun(),
+            "fragment_id": getattr(ctx, "current_fragment_id", None),
+            "thread": threading.current_thread().name,
+            "caller": caller,
+            "elapsed": elapsed,
+            "rows": rows,
+            "error": error,
+        }
+        with self._lock:
+            self._records.setdefault(
+                record["session_id"], deque(maxlen=self.max_records)
+            ).append(record)
+            if self.log_path is not None:
+                with self.log_path.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def records(self, session_id: str) -> list:
+        with self._lock:
+            return list(self._records.get(session_id, []))
+
+
+@st.cache_resource
+def get_query_log() -> QueryLog:
+    return QueryLog(
+        max_records=int(get_setting("query_accounting_max_records", 1000)),
+        log_path=get_setting("query_accounting_log_path"),
+    )
+
+
+def instrument_session(session: Session) -> Session:
+    """セッションが発行するクエリを QueryLog に記録するようにする。
+
+    DataFrame の collect() / to_pandas() / count()、merge()、save_as_table() などは
+    いずれもコネクションの execute() を通るため、そこで計測する。同じセッションには一度だけ適用する。
+    """
+    if getattr(session, "_swtt_query_accounting", False):
+        return session
+
+    conn = session._conn
+    execute = conn.execute
+    query_log = get_query_log()
+
+    def accounted_execute(*args, **kwargs):
+        caller = _find_caller()
+        started_at = time.perf_counter()
+        try:
+            result = execute(*args, **kwargs)
+        except Exception as e:
+            query_log.record(caller, time.perf_counter() - started_at, None, repr(e))
+            raise
+        query_log.record(caller, time.perf_counter() - started_at, _count_rows(result))
+        return result
+
+    conn.execute = accounted_execute
+    session._swtt_query_accounting = True
+    return session
+
+
+def account_query(load, count_rows=_count_rows):
+    """instrument_session() を通らないクエリを実行し、QueryLog に記録する。
+
+    コネクタのカーソルで直接実行する SQL（utils.query.run_query）などに使う。
+    """
+    if not is_query_accounting_enabled():
+        return load()
+
+    caller = _find_caller()
+    query_log = get_query_log()
+    started_at = time.perf_counter()
+    try:
+        result = load()
+    except Exception as e:
+        query_log.record(caller, time.perf_counter() - started_at, None, repr(e))
+        raise
+    query_log.record(caller, time.perf_counter() - started_at, count_rows(result))
+    return result
+
+
+def summarize_records(records: list, by: list) -> pd.DataFrame:
+    # 呼び出し元などの単位で、クエリ数・合計時間（ミリ秒）・合計行数をまとめる。
+    if not records:
+        return pd.DataFrame(columns=by + ["queries", "elapsed_ms", "rows"])
+    df = pd.DataFrame(records)
+    df["elapsed_ms"] = df["elapsed"] * 1000
+    return (
+        df.groupby(by, dropna=False)
+        .agg(
+            queries=("caller", "size"),
+            elapsed_ms=("elapsed_ms", "sum"),
+            rows=("rows", "sum"),
+        )
+        .sort_values("elapsed_ms", ascending=False)
+        .reset_index()
+    )
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+from snowflake.snowpark import Session
+
+from utils.settings import get_setting
+from utils.shared_cache import SharedTTLCache
+from utils.submit_ledger import get_submit_ledger
+
+
+# ランキングの解答時間はこの時刻からの経過秒数で計算する。
+RANKING_BASE_TIME = datetime(2024, 9, 1)
+
+
+@st.cache_resource
+def get_scoreboard_cache() -> SharedTTLCache:
+    # 閲覧者が何人いても、集計はこの間隔で 1 回だけ行う。
+    return SharedTTLCache(ttl=float(get_setting("scoreboard_cache_ttl", 10.0)))
+
+
+def get_scoreboard_version(session: Session) -> int:
+    # 回答状況が変わるたびに進む番号。変わっていなければ再集計・再描画は不要。
+    return get_submit_ledger().version(session)
+
+
+def get_clear_counts(session: Session) -> pd.DataFrame:
+    # 呼び出し側で列を追加できるよう、キャッシュした DataFrame のコピーを返す。
+    version = get_scoreboard_version(session)
+    return (
+        get_scoreboard_cache()
+        .get_or_load(("clear_counts", version), lambda: _load_clear_counts(session))
+        .copy()
+    )
+
+
+def get_ranking(session: Session, limit: int) -> pd.DataFrame:
+    version = get_scoreboard_version(session)
+    return (
+        get_scoreboard_cache()
+        .get_or_load(
+            ("ranking", limit, version), lambda: _load_ranking(session, limit)
+        )
+        .copy()
+    )
+
+
+def _load_clear_counts(session: Session) -> pd.DataFrame:
+    # 問題ごとのクリアチーム数。列名は Snowpark の to_pandas() の結果に合わせる。
+    clear_counts = get_submit_ledger().clear_counts(session)
+    return pd.DataFrame(
+        list(clear_counts.items()), columns=["PROBLEM_ID", "IS_CLEAR"]
+    )
+
+
+def _load_ranking(session: Session, limit: int) -> pd.DataFrame:
+    # 解けた問題数を重視しつつ、初回クリアまでの時間も加味したスコアで並べる。
+    team_scores = {}
+    for (team_id, _), first_clear_ts in get_submit_ledger().first_clears(session).items():
+        solved_count, total_solve_time = team_scores.get(team_id, (0, 0))
+        team_scores[team_id] = (
+            solved_count + 1,
+            total_solve_time + int((first_clear_ts - RANKING_BASE_TIME).total_seconds()),
+        )
+
+    pdf_scores = pd.DataFrame(
+        [
+            (team_id, solved_count, solved_count * 100000 - total_solve_time / 3600)
+            for team_id, (solved_count, total_solve_time) in team_scores.items()
+        ],
+        columns=["TEAM_ID", "SOLVED_PROBLEMS_COUNT", "SCORE"],
+    )
+    return (
+        pdf_scores.sort_values("SCORE", ascending=False)
+        .head(limit)
+        .reset_index(drop=True)
+    )
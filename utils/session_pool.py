@@ -0,0 +1,168 @@
+import threading
+import time
+
+import streamlit as st
+from snowflake.snowpark import Session
+
+from utils.settings import get_setting
+
+
+# 認証トークン・セッションの有効期限切れを示す Snowflake のエラーコード。
+AUTH_ERROR_CODES = {390111, 390112, 390114}
+
+
+def _build_session(team_id: str) -> Session:
+    if get_setting("backend", "snowflake") == "local":
+        # Snowflake に接続せず、プロセス内の代替バックエンドを使う（負荷試験・計測用）。
+        from utils.local_backend import get_local_backend
+
+        return get_local_backend().build_session(team_id)
+
+    secret = st.secrets["connections"][team_id]
+    config = {
+        "account":  secret["account"],
+        "user":     secret["user"],
+        "password": secret["password"],
+        "role":     secret.get("role"),
+        "warehouse":secret.get("warehouse"),
+        "database": secret.get("database"),
+        "schema":   secret.get("schema"),
+        # 認証トークンの有効期限切れを防ぐため、コネクタ側でハートビートを送る。
+        "client_session_keep_alive": True,
+    }
+    return Session.builder.configs(config).create()
+
+
+def _is_auth_error(error: Exception) -> bool:
+    # Snowpark の例外は sql_error_code、コネクタの例外は errno にエラーコードを持つ。
+    error_code = getattr(error, "sql_error_code", None) or getattr(error, "errno", None)
+    return error_code in AUTH_ERROR_CODES
+
+
+def get_current_user_id(session: Session) -> str:
+    # get_current_user() は毎回サーバーへの問い合わせになるため、結果をセッションに保持する。
+    # セッションを作り直した場合は新しいオブジェクトになるため、自動的に再取得される。
+    user_id = getattr(session, "_swtt_current_user_id", None)
+    if user_id is None:
+        user_id = session.get_current_user()[1:-1]
+        session._swtt_current_user_id = user_id
+    return user_id
+
+
+class SessionPool:
+    """チームごとの Snowpark セッションを使い回すプール。
+
+    最後に正常応答を確認してから health_check_interval 秒以内であれば、
+    ヘルスチェック (SELECT 1) を省略してそのままセッションを返す。
+    プールのセッションでクエリが成功するたびに、正常応答を確認した時刻を更新する。
+    認証エラーで失敗した場合はセッションを破棄し、次回の取り出しで再接続する。
+    """
+
+    def __init__(self, health_check_interval: float, builder=_build_session):
+        self.health_check_interval = health_check_interval
+        self._builder = builder
+
+        self._lock = threading.Lock()
+        self._team_locks = {}
+        self._entries = {}
+        self._metrics = {"checkouts": 0, "reconnects": 0, "wait_time": 0.0}
+
+    def _team_lock(self, team_id: str) -> threading.RLock:
+        # ヘルスチェック中のクエリから invalidate() が呼ばれることがあるため、再入可能にする。
+        with self._lock:
+            return self._team_locks.setdefault(team_id, threading.RLock())
+
+    def _is_healthy(self, session: Session) -> bool:
+        try:
+            if session.connection.is_closed():
+                return False
+            session.sql("SELECT 1").collect()
+            return True
+        except Exception as e:
+            # 認証トークンの有効期限切れもここで検知し、再接続させる。
+            print(e)
+            return False
+
+    def checkout(self, team_id: str) -> Session:
+        started_at = time.monotonic()
+
+        with self._team_lock(team_id):
+            entry = self._entries.get(team_id)
+            is_reconnect = False
+
+            if entry is not None and (
+                time.monotonic() - entry["last_ok"] > self.health_check_interval
+            ):
+                if self._is_healthy(entry["session"]):
+                    entry["last_ok"] = time.monotonic()
+                else:
+                    print("セッションの有効期限切れを検知しました。再接続します。")
+                    self._close(entry["session"])
+                    entry = None
+                    is_reconnect = True
+
+            if entry is None:
+                session = self._builder(team_id)
+                # 書き込みバッファがフラッシュ時にプールから取り直せるよう、取り出し元のチームを覚えておく。
+                session._swtt_pool_team_id = team_id
+                self._track(team_id, session)
+                entry = {"session": session, "last_ok": time.monotonic()}
+                self._entries[team_id] = entry
+
+        with self._lock:
+            self._metrics["checkouts"] += 1
+            self._metrics["reconnects"] += int(is_reconnect)
+            self._metrics["wait_time"] += time.monotonic() - started_at
+
+        return entry["session"]
+
+    def _track(self, team_id: str, session: Session) -> None:
+        # クエリはすべてコネクションの execute() を通るため、そこで結果を見る。
+        conn = session._conn
+        execute = conn.execute
+
+        def tracked_execute(*args, **kwargs):
+            try:
+                result = execute(*args, **kwargs)
+            except Exception as e:
+                if _is_auth_error(e):
+                    print("認証の有効期限切れを検知しました。次回の取り出しで再接続します。")
+                    self.invalidate(team_id, session)
+                raise
+            self.mark_healthy(team_id, session)
+            return result
+
+        conn.execute = tracked_execute
+
+    def mark_healthy(self, team_id: str, session: Session = None) -> None:
+        # クエリが成功したタイミングで呼ぶと、次回のヘルスチェックを先送りできる。
+        # session を指定した場合は、プールのセッションがそれと同じときだけ更新する。
+        entry = self._entries.get(team_id)
+        if entry is not None and (session is None or entry["session"] is session):
+            entry["last_ok"] = time.monotonic()
+
+    def invalidate(self, team_id: str, session: Session = None) -> None:
+        with self._team_lock(team_id):
+            entry = self._entries.get(team_id)
+            if entry is None or (session is not None and entry["session"] is not session):
+                return
+            del self._entries[team_id]
+            self._close(entry["session"])
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._metrics)
+
+    @staticmethod
+    def _close(session: Session) -> None:
+        try:
+            session.close()
+        except Exception as e:
+            print(e)
+
+
+@st.cache_resource
+def get_session_pool() -> SessionPool:
+    return SessionPool(
+        health_check_interval=float(get_setting("health_check_interval", 300.0)),
+    )
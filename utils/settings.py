@@ -0,0 +1,10 @@
+import streamlit as st
+
+
+def get_setting(name: str, default=None):
+    # secrets.toml の [swtt] セクションに記載があれば、その値でデフォルト値を上書きする。
+    # ローカル実行などで secrets.toml が存在しない場合もデフォルト値で動作させる。
+    try:
+        return st.secrets["swtt"][name]
+    except (KeyError, FileNotFoundError):
+        return default
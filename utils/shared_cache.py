@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class SharedTTLCache:
+    """プロセス全体で共有する TTL 付き LRU キャッシュ。
+
+    同じキーの読み込みが同時に発生した場合は 1 回だけ実行し（single-flight）、
+    他の呼び出しはその結果を待って使う。
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _get_fresh(self, key):
+        # 呼び出し側で self._lock を取得していること。
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry[1]
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            is_fresh, value = self._get_fresh(key)
+            if is_fresh:
+                self._stats["hits"] += 1
+                return value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # 待っている間に他の呼び出しが読み込んでいれば、その結果を使う。
+            with self._lock:
+                is_fresh, value = self._get_fresh(key)
+                if is_fresh:
+                    self._stats["hits"] += 1
+                    return value
+                self._stats["misses"] += 1
+
+            value = loader()
+
+            with self._lock:
+                self._entries[key] = (time.monotonic(), value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    evicted_key, _ = self._entries.popitem(last=False)
+                    self._key_locks.pop(evicted_key, None)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
@@ -0,0 +1,347 @@
+import atexit
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import streamlit as st
+from snowflake.snowpark import Session
+from snowflake.snowpark import functions as F
+from snowflake.snowpark.types import (
+    BooleanType,
+    LongType,
+    StringType,
+    StructField,
+    StructType,
+    TimestampType,
+)
+
+from utils.session_pool import get_session_pool
+from utils.settings import get_setting
+
+
+SUBMIT_TABLE = "submit2"
+
+SUBMIT_SCHEMA = StructType(
+    [
+        StructField("team_id", StringType()),
+        StructField("problem_id", StringType()),
+        StructField("timestamp", TimestampType()),
+        StructField("is_clear", BooleanType()),
+        StructField("key", StringType()),
+        StructField("max_attempts", LongType()),
+        StructField("submit_id", StringType()),
+    ]
+)
+SUBMIT_COLUMNS = [field.name.lower() for field in SUBMIT_SCHEMA.fields]
+
+# SUBMIT2 を (team_id, problem_id, key) ごとに集約したテーブル。読み込みはすべてこちらを使う。
+STATUS_TABLE = "team_problem_status"
+STATUS_SCHEMA = StructType(
+    [
+        StructField("team_id", StringType()),
+        StructField("problem_id", StringType()),
+        StructField("key", StringType()),
+        StructField("attempts", LongType()),
+        StructField("max_attempts", LongType()),
+        StructField("first_clear_ts", TimestampType()),
+        StructField("last_ts", TimestampType()),
+    ]
+)
+STATUS_KEY_COLUMNS = ["team_id", "problem_id", "key"]
+STATUS_VALUE_COLUMNS = ["attempts", "max_attempts", "first_clear_ts", "last_ts"]
+
+
+def build_submit_row(
+    team_id: str,
+    problem_id: str,
+    is_clear,
+    key: str,
+    max_attempts: int,
+    submit_id: str,
+) -> dict:
+    return {
+        "team_id": team_id,
+        "problem_id": problem_id,
+        "timestamp": datetime.now(),
+        "is_clear": is_clear,
+        "key": key,
+        "max_attempts": max_attempts,
+        "submit_id": submit_id,
+    }
+
+
+def _status_key_condition(left, right):
+    # 手作業で投入した行は key が NULL のことがあるため、NULL 同士も一致として扱う。
+    condition = None
+    for column in STATUS_KEY_COLUMNS:
+        column_condition = left[column].equal_null(right[column])
+        condition = (
+            column_condition if condition is None else condition & column_condition
+        )
+    return condition
+
+
+def merge_team_problem_status(session: Session, touched) -> None:
+    """touched に含まれる (team_id, problem_id, key) の集約を SUBMIT2 から計算し直す。
+
+    差分ではなく計算し直した値で上書きするため、何度実行しても結果は変わらない。
+    """
+    submit = session.table(SUBMIT_TABLE)
+    touched = touched.select(*STATUS_KEY_COLUMNS).distinct()
+    aggregated = (
+        submit.join(
+            touched, _status_key_condition(submit, touched), join_type="leftsemi"
+        )
+        .group_by(*STATUS_KEY_COLUMNS)
+        .agg(
+            F.count(F.lit(1)).alias("attempts"),
+            F.max(F.col("max_attempts")).alias("max_attempts"),
+            F.min(F.when(F.col("is_clear"), F.col("timestamp"))).alias(
+                "first_clear_ts"
+            ),
+            F.max(F.col("timestamp")).alias("last_ts"),
+        )
+    )
+
+    status = session.table(STATUS_TABLE)
+    status.merge(
+        aggregated,
+        _status_key_condition(status, aggregated),
+        [
+            F.when_matched().update(
+                {column: aggregated[column] for column in STATUS_VALUE_COLUMNS}
+            ),
+            F.when_not_matched().insert(
+                {
+                    column: aggregated[column]
+                    for column in STATUS_KEY_COLUMNS + STATUS_VALUE_COLUMNS
+                }
+            ),
+        ],
+    )
+
+
+def merge_is_clear(current, incoming):
+    # 同じ回答（submit_id）が再送された場合の is_clear。一度でもクリアならクリアのままにする。
+    if current is True or incoming is True:
+        return True
+    return incoming if incoming is not None else current
+
+
+class SubmitJob:
+    """SUBMIT2 への 1 回答分の書き込みの完了を追跡するハンドル。
+
+    書き込みに失敗すると error に例外が入るが、バッファが再試行するため完了扱いにはならない。
+    再試行の上限を超えて書き込みを諦めた場合は、abandoned を True にして完了扱いにする。
+    """
+
+    def __init__(self, submit_id: str):
+        self.submit_id = submit_id
+        self.error = None
+        self.failures = 0
+        # 画面に通知済みの失敗回数。
+        self.reported_failures = 0
+        self.abandoned = False
+        self._done = threading.Event()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _resolve(self) -> None:
+        self.error = None
+        self._done.set()
+
+    def _fail(self, error: Exception) -> None:
+        self.error = error
+        self.failures += 1
+
+    def _abandon(self, error: Exception) -> None:
+        self._fail(error)
+        self.abandoned = True
+        self._done.set()
+
+
+class SubmitBuffer:
+    """SUBMIT2 への書き込みを全セッション分まとめて行うライトビハインドバッファ。
+
+    行数が max_rows に達するか、flush_interval 秒が経過した時点で、
+    溜まった行を 1 回の MERGE で書き込む。書き込み済みの submit_id は挿入しないため、
+    失敗したフラッシュを再試行しても行は増えない。
+    続けて、書き込んだ行の (team_id, problem_id, key) について TEAM_PROBLEM_STATUS を更新する。
+
+    enqueue() は書き込みを待たずに SubmitJob を返す。書き込みが完了した時点で SubmitJob も完了する。
+
+    書き込みには、フラッシュの時点でプールから取り出したセッションを使う。
+    書き込みに失敗した行は次回のフラッシュで再試行し、max_retries 回を超えたら破棄する。
+    """
+
+    def __init__(self, max_rows: int, flush_interval: float, max_retries: int = 5):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # submit_id ごとの未書き込みの行と、その書き込みを待っている SubmitJob。
+        self._rows = {}
+        self._jobs = {}
+        # 書き込み中の行。書き込みが完了するまでは未反映の行として扱う。
+        self._inflight = []
+        # submit_id ごとの書き込みに失敗した回数。
+        self._retries = {}
+        self._session = None
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="submit-buffer-flusher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _queue_row(self, row: dict, jobs: list) -> None:
+        # 呼び出し側で self._lock を取得していること。
+        submit_id = row["submit_id"]
+        queued_row = self._rows.get(submit_id)
+        if queued_row is not None:
+            queued_row["is_clear"] = merge_is_clear(
+                queued_row["is_clear"], row["is_clear"]
+            )
+        else:
+            self._rows[submit_id] = row
+        self._jobs.setdefault(submit_id, []).extend(jobs)
+
+    def enqueue(self, session: Session, row: dict) -> SubmitJob:
+        job = SubmitJob(row["submit_id"])
+        with self._lock:
+            self._session = session
+            self._queue_row(row, [job])
+            is_full = len(self._rows) >= self.max_rows
+
+        # 書き込みはフラッシュ用スレッドに任せ、回答の処理はブロックしない。
+        if is_full:
+            self._wakeup.set()
+        return job
+
+    def pending_rows(self) -> list:
+        with self._lock:
+            return self._inflight + list(self._rows.values())
+
+    @contextmanager
+    def paused(self):
+        # この間はフラッシュが行われないため、書き込み済みの行と pending_rows() が重複も欠落もしない。
+        with self._flush_lock:
+            yield
+
+    def _checkout_session(self, session: Session) -> Session:
+        # 最後に回答したセッションはフラッシュまでに閉じられていることがあるため、プールから取り直す。
+        pool_team_id = getattr(session, "_swtt_pool_team_id", None)
+        if pool_team_id is None:
+            return session
+        return get_session_pool().checkout(pool_team_id)
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                if not self._rows:
+                    return 0
+                rows = list(self._rows.values())
+                jobs = self._jobs
+                session = self._session
+                self._rows = {}
+                self._jobs = {}
+                self._inflight = rows
+
+            try:
+                session = self._checkout_session(session)
+                source = session.create_dataframe(
+                    [[row[column] for column in SUBMIT_COLUMNS] for row in rows],
+                    schema=SUBMIT_SCHEMA,
+                )
+                target = session.table(SUBMIT_TABLE)
+                # 書き込み済みの submit_id は挿入せず、クリア状況だけを反映する。
+                # SUBMIT2 のクラスタリングキーでも突き合わせ、走査するマイクロパーティションを絞る。
+                target.merge(
+                    source,
+                    _status_key_condition(target, source)
+                    & (target["submit_id"] == source["submit_id"]),
+                    [
+                        F.when_matched().update(
+                            {
+                                "is_clear": F.when(
+                                    F.coalesce(target["is_clear"], F.lit(False))
+                                    | F.coalesce(source["is_clear"], F.lit(False)),
+                                    F.lit(True),
+                                ).otherwise(
+                                    F.coalesce(source["is_clear"], target["is_clear"])
+                                )
+                            }
+                        ),
+                        F.when_not_matched().insert(
+                            {column: source[column] for column in SUBMIT_COLUMNS}
+                        ),
+                    ],
+                )
+                # 集約の更新に失敗して再試行しても、SUBMIT2 への MERGE は重複しない。
+                merge_team_problem_status(session, source)
+
+            except Exception as e:
+                print("回答結果の書き込みに失敗しました。次回のフラッシュで再試行します。")
+                print(e)
+                abandoned_ids = []
+                with self._lock:
+                    for row in rows:
+                        submit_id = row["submit_id"]
+                        retries = self._retries.get(submit_id, 0) + 1
+                        if retries > self.max_retries:
+                            # 書き込めない原因が解消しない行で、後続の書き込みが止まらないようにする。
+                            self._retries.pop(submit_id, None)
+                            abandoned_ids.append(submit_id)
+                        else:
+                            self._retries[submit_id] = retries
+                            self._queue_row(row, jobs[submit_id])
+                    self._inflight = []
+                if abandoned_ids:
+                    print(
+                        f"再試行の上限を超えたため、{len(abandoned_ids)} 件の回答結果を破棄しました。"
+                    )
+                for submit_id, submit_jobs in jobs.items():
+                    for job in submit_jobs:
+                        if submit_id in abandoned_ids:
+                            job._abandon(e)
+                        else:
+                            job._fail(e)
+                return 0
+
+            with self._lock:
+                self._inflight = []
+                for row in rows:
+                    self._retries.pop(row["submit_id"], None)
+            for submit_jobs in jobs.values():
+                for job in submit_jobs:
+                    job._resolve()
+            return len(rows)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+@st.cache_resource
+def get_submit_buffer() -> SubmitBuffer:
+    return SubmitBuffer(
+        max_rows=int(get_setting("submit_buffer_max_rows", 20)),
+        flush_interval=float(get_setting("submit_buffer_flush_interval", 2.0)),
+        max_retries=int(get_setting("submit_buffer_max_retries", 5)),
+    )
@@ -0,0 +1,278 @@
+import threading
+import time
+import uuid
+
+import streamlit as st
+from snowflake.snowpark import Session
+from snowflake.snowpark import functions as F
+
+from utils.settings import get_setting
+from utils.submit_buffer import (
+    STATUS_TABLE,
+    SubmitJob,
+    build_submit_row,
+    get_submit_buffer,
+)
+
+
+def _apply_first_clear(
+    first_clears: dict, clear_counts: dict, team_id: str, problem_id: str, timestamp
+) -> None:
+    clear_key = (team_id, problem_id)
+    if clear_key not in first_clears:
+        first_clears[clear_key] = timestamp
+        clear_counts[problem_id] = clear_counts.get(problem_id, 0) + 1
+    elif timestamp < first_clears[clear_key]:
+        first_clears[clear_key] = timestamp
+
+
+def _apply_row(
+    entries: dict, first_clears: dict, clear_counts: dict, row: dict
+) -> None:
+    entry_key = (row["team_id"], row["problem_id"], row["key"])
+    entry = entries.setdefault(
+        entry_key, {"attempts": 0, "is_clear": False, "max_attempts": None}
+    )
+    entry["attempts"] += 1
+    entry["is_clear"] = entry["is_clear"] or row["is_clear"] is True
+    if row["max_attempts"] is not None:
+        entry["max_attempts"] = max(entry["max_attempts"] or 0, row["max_attempts"])
+
+    if row["is_clear"] is True:
+        _apply_first_clear(
+            first_clears, clear_counts, row["team_id"], row["problem_id"], row["timestamp"]
+        )
+
+
+class SubmitLedger:
+    """(team_id, problem_id, key) ごとの回答回数とクリア状況を保持する台帳。
+
+    スコアボード用に、(team_id, problem_id) ごとの初回クリア時刻と問題ごとのクリアチーム数も保持する。
+
+    集約済みの TEAM_PROBLEM_STATUS を読み込み、以降はこのプロセスの書き込みで差分更新する。
+    他のレプリカの書き込みを取り込むため、max_staleness 秒を過ぎたら読み込み直す。
+    読み込み直す前に MAX(last_ts)・回答回数の合計・クリア件数だけを確認し、変化がなければ読み込みは省略する。
+
+    内容が変わるたびに version を進めるため、表示側は version が変わったときだけ再描画すればよい。
+
+    読み込みはバッファのフラッシュを止めて行い、未書き込みの行と合わせて一貫した状態を作る。
+    読み込み後、差し替えまでの間に記録された回答は、差し替えた後に反映し直す。
+    """
+
+    def __init__(self, max_staleness: float):
+        self.max_staleness = max_staleness
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._entries = {}
+        self._first_clears = {}
+        self._clear_counts = {}
+        self._loaded_at = None
+        self._high_water = None
+        self._version = 0
+        # 読み込み中に記録された回答。読み込み中でなければ None。
+        self._recorded_during_refresh = None
+
+    def _is_stale(self) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.max_staleness
+        )
+
+    def _probe_high_water(self, session: Session) -> tuple:
+        row = (
+            session.table(STATUS_TABLE)
+            .agg(
+                F.max(F.col("last_ts")).alias("high_water"),
+                F.sum(F.col("attempts")).alias("attempts"),
+                F.count(F.col("first_clear_ts")).alias("clear_count"),
+            )
+            .collect()[0]
+        )
+        return row["HIGH_WATER"], row["ATTEMPTS"], row["CLEAR_COUNT"]
+
+    def refresh(self, session: Session, force: bool = False) -> None:
+        with self._refresh_lock:
+            if not force and not self._is_stale():
+                return
+
+            # TEAM_PROBLEM_STATUS が前回の読み込みから変わっていなければ、読み込みは省略する。
+            high_water = self._probe_high_water(session)
+            if not force and high_water == self._high_water:
+                with self._lock:
+                    self._loaded_at = time.monotonic()
+                return
+
+            buffer = get_submit_buffer()
+            with buffer.paused():
+                rows = session.table(STATUS_TABLE).collect()
+                # record() は台帳のロックを取ってバッファに積むため、ここから先の回答は
+                # pending_rows() に含まれず、_recorded_during_refresh に記録される。
+                with self._lock:
+                    pending_rows = buffer.pending_rows()
+                    self._recorded_during_refresh = []
+
+            entries = {}
+            first_clears = {}
+            clear_counts = {}
+            for row in rows:
+                entries[(row["TEAM_ID"], row["PROBLEM_ID"], row["KEY"])] = {
+                    "attempts": row["ATTEMPTS"],
+                    "is_clear": row["FIRST_CLEAR_TS"] is not None,
+                    "max_attempts": row["MAX_ATTEMPTS"],
+                }
+                if row["FIRST_CLEAR_TS"] is not None:
+                    _apply_first_clear(
+                        first_clears,
+                        clear_counts,
+                        row["TEAM_ID"],
+                        row["PROBLEM_ID"],
+                        row["FIRST_CLEAR_TS"],
+                    )
+            # まだ書き込まれていないバッファ上の回答は集計結果に含まれないため、上乗せする。
+            for row in pending_rows:
+                _apply_row(entries, first_clears, clear_counts, row)
+
+            with self._lock:
+                for row in self._recorded_during_refresh:
+                    _apply_row(entries, first_clears, clear_counts, row)
+                self._recorded_during_refresh = None
+                self._entries = entries
+                self._first_clears = first_clears
+                self._clear_counts = clear_counts
+                self._loaded_at = time.monotonic()
+                self._high_water = high_water
+                self._version += 1
+
+    def record(self, session: Session, row: dict) -> SubmitJob:
+        # 台帳への反映とバッファへの積み込みは、読み込み中のスナップショットと重ならないよう同じロックの中で行う。
+        with self._lock:
+            _apply_row(self._entries, self._first_clears, self._clear_counts, row)
+            if self._recorded_during_refresh is not None:
+                self._recorded_during_refresh.append(row)
+            self._version += 1
+            return get_submit_buffer().enqueue(session, row)
+
+    def version(self, session: Session) -> int:
+        self.refresh(session)
+        with self._lock:
+            return self._version
+
+    def get(
+        self, session: Session, team_id: str, problem_id: str, key: str = "main"
+    ) -> dict:
+        self.refresh(session)
+        with self._lock:
+            entry = self._entries.get((team_id, problem_id, key))
+            return dict(entry) if entry else {
+                "attempts": 0,
+                "is_clear": False,
+                "max_attempts": None,
+            }
+
+    def attempts(
+        self, session: Session, team_id: str, problem_id: str, key: str = "main"
+    ) -> int:
+        return self.get(session, team_id, problem_id, key)["attempts"]
+
+    def is_clear(self, session: Session, team_id: str, problem_id: str) -> bool:
+        # クリア判定は key を問わず、いずれかの回答がクリアであれば True とする。
+        self.refresh(session)
+        with self._lock:
+            return any(
+                entry["is_clear"]
+                for (entry_team_id, entry_problem_id, _), entry in self._entries.items()
+                if entry_team_id == team_id and entry_problem_id == problem_id
+            )
+
+    def team_statuses(self, session: Session, team_id: str) -> dict:
+        # チームの全問題の状況を problem_id ごとにまとめて返す。回答回数は key="main" のみ数える。
+        self.refresh(session)
+        statuses = {}
+        with self._lock:
+            for (entry_team_id, problem_id, key), entry in self._entries.items():
+                if entry_team_id != team_id:
+                    continue
+                status = statuses.setdefault(
+                    problem_id,
+                    {"attempts": 0, "is_clear": False, "max_attempts": None},
+                )
+                status["is_clear"] = status["is_clear"] or entry["is_clear"]
+                if key == "main":
+                    status["attempts"] = entry["attempts"]
+                    status["max_attempts"] = entry["max_attempts"]
+        return statuses
+
+    def clear_counts(self, session: Session) -> dict:
+        self.refresh(session)
+        with self._lock:
+            return dict(self._clear_counts)
+
+    def first_clears(self, session: Session) -> dict:
+        self.refresh(session)
+        with self._lock:
+            return dict(self._first_clears)
+
+
+@st.cache_resource
+def get_submit_ledger() -> SubmitLedger:
+    return SubmitLedger(
+        max_staleness=float(get_setting("ledger_max_staleness", 30.0)),
+    )
+
+
+def _submit_id_state_name(team_id: str, problem_id: str, key: str) -> str:
+    return f"{problem_id}_{team_id}_{key}_submit_id"
+
+
+def issue_submit_id(team_id: str, problem_id: str, key: str = "main") -> None:
+    # 回答ボタンの on_click で呼び、押されるたびに新しい submit_id を発行する。
+    # submit_id は SUBMIT2 への書き込みを再試行したときに、同じ回答を重複して挿入しないために使う。
+    st.session_state[_submit_id_state_name(team_id, problem_id, key)] = (
+        uuid.uuid4().hex
+    )
+
+
+def record_submission(
+    session: Session,
+    team_id: str,
+    problem_id: str,
+    is_clear,
+    key: str,
+    max_attempts: int,
+) -> SubmitJob:
+    # 回答の書き込みはすべてここを通す。台帳へ即時に反映してから、SUBMIT2 への書き込みをバッファに積む。
+    # 書き込みの完了は待たない。返した SubmitJob はセッションごとに追跡し、次の再実行で結果を確認する。
+    # submit_id はボタンの押下ごとに一度だけ使う。発行されていない場合は、その場で発行する。
+    submit_id = st.session_state.pop(
+        _submit_id_state_name(team_id, problem_id, key), None
+    )
+    row = build_submit_row(
+        team_id,
+        problem_id,
+        is_clear,
+        key,
+        max_attempts,
+        submit_id or uuid.uuid4().hex,
+    )
+    job = get_submit_ledger().record(session, row)
+    st.session_state.setdefault("submit_jobs", []).append(job)
+    return job
+
+
+def collect_submit_jobs() -> list:
+    """このセッションで追跡中の書き込みのうち、失敗したものを返す。完了したものは追跡をやめる。
+
+    同じ失敗を繰り返し返さないよう、前回確認した後に失敗したものだけを返す。
+    書き込みを諦めたもの（abandoned）も、一度だけ返してから追跡をやめる。
+    """
+    failed_jobs = []
+    pending_jobs = []
+    for job in st.session_state.get("submit_jobs", []):
+        if job.failures > job.reported_failures:
+            job.reported_failures = job.failures
+            failed_jobs.append(job)
+        if not job.done():
+            pending_jobs.append(job)
+    st.session_state["submit_jobs"] = pending_jobs
+    return failed_jobs
@@ -1,31 +1,28 @@
 import hashlib
-from datetime import datetime
 
-import pandas as pd
 import streamlit as st
-import snowflake.snowpark.functions as F
 from snowflake.snowpark import Session
-from snowflake.snowpark.exceptions import SnowparkSQLException
 
 from utils.attempt_limiter import check_is_failed, update_failed_status
+from utils.problem_registry import PROBLEM_MANIFEST
+from utils.query import get_table_preview
+from utils.query_accounting import (
+    get_query_log,
+    instrument_session,
+    is_query_accounting_enabled,
+    summarize_records,
+)
+from utils.session_pool import get_current_user_id, get_session_pool
+from utils.submit_ledger import (
+    collect_submit_jobs,
+    get_submit_ledger,
+    issue_submit_id,
+    record_submission,
+)
 
 
 TAB_TITLES = {
-    "q1_test": "⌛️過去忘却の鬼 ~ 歴史の呼吸 ~",
-    "q2_test": "🧩不規則の鬼 ~ 法則の呼吸 ~",
-    "q3_test": "🧭混迷の鬼 ~ 判別の呼吸 ~",
-    "q4_test": "🔍️真偽の鬼 ~ 見極めの呼吸 ~",
-    "q5_test": "🌊波紋の鬼 ~ コミュニティの呼吸 ~",
-    "q6_test": "📊分析の鬼 ~ 言葉の呼吸 ~",
-}
-
-DEMON_NAME = {
-    "q1_test": "過去忘却の鬼",
-    "q2_test": "不規則の鬼",
-    "q3_test": "混迷の鬼",
-    "q4_test": "真偽の鬼",
-    "q5_test": "波紋の鬼",
-    "q6_test": "分析の鬼",
+    problem_id: problem["title"] for problem_id, problem in PROBLEM_MANIFEST.items()
 }
 
 # Key: 表示されるチーム名
@@ -59,43 +56,14 @@ TEAMS = {
 }
 
 
-@st.cache_resource(ttl=3600)
-def _build_session(team_id: str) -> Session:
-    secret = st.secrets["connections"][team_id]
-    config = {
-        "account":  secret["account"],
-        "user":     secret["user"],
-        "password": secret["password"],
-        "role":     secret.get("role"),
-        "warehouse":secret.get("warehouse"),
-        "database": secret.get("database"),
-        "schema":   secret.get("schema"),
-    }
-    session = Session.builder.configs(config).create()
-    session.sql("SELECT 1").collect()
-    return session
-
-
 def create_session(team_id: str, is_info: bool = True) -> Session:
     try:
-        session = _build_session(team_id)
-        session.sql("SELECT 1").collect()
+        session = get_session_pool().checkout(team_id)
         print("セッションの作成に成功しました。")
         if is_info:
             st.success("鬼との戦いの準備は整った！いざ、決戦の地へ！")
         return session
 
-    except SnowparkSQLException as e:
-        print("セッションの有効期限切れエラーが発生しました。")
-        print("セッションの再作成を試みます。")
-        _build_session.clear()
-        session = _build_session(team_id)
-        session.sql("SELECT 1").collect()
-        print("セッションの再作成に成功しました。")
-        if is_info:
-            st.success("鬼との戦いの準備は整った！いざ、決戦の地へ！")
-        return session
-
     except Exception as e:
         if is_info:
             st.error("複雑空城の結界が強固すぎる...！なにか問題が発生したようだ。")
@@ -110,7 +78,22 @@ def get_session():
             st.switch_page("app.py")
         st.stop()
     else:
+        # プールから取り直すことで、再接続後のセッションに差し替える。
+        # ヘルスチェックは一定間隔でしか行わないため、通常はクエリは発生しない。
+        if st.session_state.get("team_id") in TEAMS:
+            try:
+                st.session_state.snow_session = get_session_pool().checkout(
+                    TEAMS[st.session_state.team_id]
+                )
+            except Exception as e:
+                st.error("複雑空城の結界が強固すぎる...！なにか問題が発生したようだ。")
+                print(e)
+                st.stop()
         session = st.session_state.snow_session
+        if is_query_accounting_enabled():
+            # 以降のクエリを、この再実行・ページのものとして記録する。
+            session = instrument_session(session)
+            get_query_log().begin_rerun()
         return session
 
 
@@ -135,10 +118,67 @@ def display_team_id_sidebar():
             print(e)
 
 
+def display_query_accounting_sidebar():
+    # ページの最後で呼び出し、この再実行で発生したクエリとページごとの累計をサイドバーに表示する。
+    if not is_query_accounting_enabled():
+        return
+
+    query_log = get_query_log()
+    rerun = query_log.current_rerun()
+    records = query_log.records(rerun["session_id"])
+    rerun_records = [
+        record for record in records if record["rerun_id"] == rerun["rerun_id"]
+    ]
+
+    with st.sidebar:
+        st.divider()
+        with st.expander("クエリ計測", expanded=False):
+            st.caption(
+                f"この再実行: {len(rerun_records)} クエリ / "
+                f"{sum(record['elapsed'] for record in rerun_records) * 1000:.0f} ms"
+            )
+            st.dataframe(summarize_records(rerun_records, ["caller"]), hide_index=True)
+            st.caption("ページごとの累計")
+            st.dataframe(summarize_records(records, ["page"]), hide_index=True)
+
+
 def display_team_id():
     st.write(f"そなたらの討伐隊は 「**{st.session_state.team_id}**」 だ。")
 
 
+def display_submit_job_errors():
+    # 前回までの回答の書き込みに失敗していれば知らせる。書き込みは裏で再試行される。
+    for job in collect_submit_jobs():
+        if job.abandoned:
+            st.error(
+                "回答結果を保存できませんでした。運営に知らせてください。",
+                icon="🚨",
+            )
+            continue
+        st.warning(
+            f"回答結果の保存に失敗しました。自動で再試行しています。（{job.failures} 回目）",
+            icon="⚠️",
+        )
+
+
+def display_table_preview(
+    session: Session, table_name: str, label: str = "📊 データテーブル構造を確認"
+):
+    # トグルを開いたときだけ読み込む。読み込み結果は全チームで共有される。
+    if not st.toggle(label, key=f"{table_name}_preview_toggle"):
+        return
+
+    with st.container(border=True):
+        try:
+            preview = get_table_preview(session, table_name)
+            st.dataframe(preview["rows"], use_container_width=True)
+            with st.expander("列定義", expanded=False):
+                st.dataframe(preview["schema"], use_container_width=True, hide_index=True)
+            st.caption(f"データソース: {table_name}")
+        except Exception as e:
+            st.error(f"データ取得エラー: {str(e)}")
+
+
 def get_team_id():
     if "team_id" not in st.session_state:
         st.warning("そなたらは、まだ討伐隊として誓いが結ばれていないようだの・・・。")
@@ -156,7 +196,7 @@ def init_state(tab_name: str, session: Session, max_attempts: int = 3):
 
     state = st.session_state.state
 
-    state["team_id"] = session.get_current_user()[1:-1]
+    state["team_id"] = get_current_user_id(session)
     state["problem_id"] = tab_name
 
     state["is_clear"] = check_is_clear(session, state)
@@ -166,31 +206,17 @@ def init_state(tab_name: str, session: Session, max_attempts: int = 3):
 
 
 def save_table(state: dict, session: Session):
-    df = pd.DataFrame(
-        [
-            {
-                "team_id": state["team_id"],
-                "problem_id": state["problem_id"],
-                "timestamp": datetime.now(),
-                "is_clear": state["is_clear"],
-                "key": "main",
-                "max_attempts": state["max_attempts"],
-            }
-        ],
-        columns=[
-            "team_id",
-            "problem_id",
-            "timestamp",
-            "is_clear",
-            "key",
-            "max_attempts",
-        ],
-    )
-
     with st.spinner("鬼と激闘中..."):
-        # session.write_pandas(df, "SUBMIT2", auto_create_table=False, overwrite=False)
-        snow_df = session.create_dataframe(df)
-        snow_df.write.mode("append").save_as_table("submit2")
+        # 書き込みはバッファ経由でまとめて行い、完了は待たない。未書き込みの行も台帳で判定に反映される。
+        # 書き込みに失敗した場合は、次の再実行で display_submit_job_errors() が知らせる。
+        record_submission(
+            session,
+            state["team_id"],
+            state["problem_id"],
+            state["is_clear"],
+            "main",
+            state["max_attempts"],
+        )
 
         if state["is_clear"]:
             # はじめてのクリアの場合、if文内のロジックを実行する。
@@ -233,22 +259,32 @@ def save_table(state: dict, session: Session):
 
 
 def update_clear_status(session: Session, state: dict) -> None:
-    submit_table = session.table("submit2")
+    st.session_state[f"{state['problem_id']}_{state['team_id']}_is_clear"] = (
+        get_submit_ledger().is_clear(session, state["team_id"], state["problem_id"])
+    )
 
-    try:
-        result = submit_table.filter(
-            (F.col("team_id") == state["team_id"])
-            & (F.col("problem_id") == state["problem_id"])
-            & (F.col("is_clear") == True)
-        ).count()
-
-        st.session_state[f"{state['problem_id']}_{state['team_id']}_is_clear"] = (
-            result > 0
+
+def update_all_problem_statuses(
+    session: Session, team_id: str, problem_ids: list
+) -> dict:
+    # 全問題のクリア・敗北状況を台帳から一括で取得し、セッションステートに反映する。
+    # 台帳の読み込みは SUBMIT2 への集計クエリ 1 回のみのため、問題数によらずクエリ数は増えない。
+    team_statuses = get_submit_ledger().team_statuses(session, team_id)
+
+    statuses = {}
+    for problem_id in problem_ids:
+        status = team_statuses.get(
+            problem_id, {"attempts": 0, "is_clear": False, "max_attempts": None}
+        )
+        status["is_failed"] = (
+            status["max_attempts"] is not None
+            and status["attempts"] >= status["max_attempts"]
         )
+        st.session_state[f"{problem_id}_{team_id}_is_clear"] = status["is_clear"]
+        st.session_state[f"{problem_id}_{team_id}_is_failed"] = status["is_failed"]
+        statuses[problem_id] = status
 
-    except IndexError as e:
-        print(e)
-        st.session_state[f"{state['problem_id']}_{state['team_id']}_is_clear"] = False
+    return statuses
 
 
 def check_is_clear(session: Session, state: dict):